@@ -0,0 +1,305 @@
+"""Batch worm tracker script: tracks every recording of a manifest in a pool of processes"""
+import os
+import sys
+import csv
+import json
+import time
+import argparse
+import warnings
+import traceback
+import contextlib
+import multiprocessing
+from multiprocessing.connection import wait
+from collections import deque
+
+warnings.filterwarnings("ignore")
+
+import yaml
+
+from worm_tracker import track
+from src.labels import load_true_labels, load_output_labels
+from src.evaluation import evaluate, distance, custom_accuracy
+
+SUMMARY_FIELDS = [
+    "input",
+    "output",
+    "status",
+    "frames",
+    "count",
+    "distance",
+    "accuracy",
+    "seconds",
+    "error",
+]
+RESULT_FIELDS = ["frames", "count", "distance", "accuracy"]
+
+
+def parse_args(args):
+    """Parse arguments"""
+    parser = argparse.ArgumentParser(description="Batch worm tracker")
+    parser.add_argument(
+        "-M",
+        "--manifest",
+        help="path of the manifest, a csv file with the columns input, labels, output "
+        "and, optionally, annotation",
+        required=True,
+    )
+    parser.add_argument(
+        "-C",
+        "--configuration",
+        help="path of the configuration",
+        default="default_configuration.yaml",
+    )
+    parser.add_argument(
+        "-J",
+        "--jobs",
+        help="number of recordings tracked at once",
+        type=int,
+        default=multiprocessing.cpu_count(),
+    )
+    parser.add_argument(
+        "-S", "--summary", help="path of the summary", default="summary.csv"
+    )
+    parser.add_argument(
+        "-F",
+        "--force",
+        help="track every recording, even if its output is up to date",
+        action="store_true",
+    )
+    return parser.parse_args(args)
+
+
+def load_manifest(path):
+    """Loads the jobs of the manifest. Empty cells mean no such file, relative paths are
+    relative to the manifest and lines starting with '#' are ignored"""
+    directory = os.path.dirname(os.path.abspath(path))
+    jobs = []
+    with open(path, "r", newline="") as file:
+        lines = (line for line in file if line.strip() and not line.startswith("#"))
+        for row in csv.DictReader(lines):
+            job = {}
+            for field in ["input", "labels", "output", "annotation"]:
+                value = (row.get(field) or "").strip()
+                job[field] = (
+                    os.path.normpath(os.path.join(directory, value)) if value else None
+                )
+            assert job["input"] is not None, "a job of {} has no input".format(path)
+            assert job["output"] is not None, "the job of {} has no output".format(
+                job["input"]
+            )
+            jobs.append(job)
+    return jobs
+
+
+def _partial_path(path):
+    base, extension = os.path.splitext(path)
+    return base + ".part" + extension
+
+
+def up_to_date(job, configuration_path):
+    """Returns whether the outputs of the job exist and are newer than the input and the
+    configuration. Outputs are renamed into place once complete, so they are never partial"""
+    sources = max(os.path.getmtime(job["input"]), os.path.getmtime(configuration_path))
+    for field in ["output", "annotation"]:
+        path = job[field]
+        if path is not None and (
+            not os.path.exists(path) or os.path.getmtime(path) < sources
+        ):
+            return False
+    return True
+
+
+def _result_path(path):
+    return path + ".json"
+
+
+def load_result(job):
+    """Returns the evaluation that the run which wrote the output of the job recorded
+    next to it (see run_job), or None if there is none for the labels of the job"""
+    path = _result_path(job["output"])
+    try:
+        if os.path.getmtime(path) < os.path.getmtime(job["output"]):
+            return None  # the output was written by something else since
+        with open(path, "r") as file:
+            result = json.load(file)
+    except (OSError, ValueError):
+        return None
+    if result.get("labels") != job["labels"]:
+        return None
+    return {field: result[field] for field in RESULT_FIELDS}
+
+
+def evaluate_output(job, configuration):
+    """Evaluates the labels already written by a previous run of the job"""
+    labels = load_output_labels(job["output"])
+    true_labels = load_true_labels(job["labels"])
+    count, mean_distance = evaluate(true_labels, labels, distance())
+    _, mean_accuracy = evaluate(
+        true_labels,
+        labels,
+        custom_accuracy(
+            configuration["labels"]["small_radix"],
+            configuration["labels"]["big_radix"],
+        ),
+    )
+    return {"count": count, "distance": mean_distance, "accuracy": mean_accuracy}
+
+
+def run_job(job, configuration, configuration_path, force=False):
+    """Tracks a recording, logging to '<output>.log'. Any error is caught and reported
+    in the returned summary row, so that it doesn't stop the other jobs"""
+    start_time = time.perf_counter()
+    row = {"input": job["input"], "output": job["output"]}
+    try:
+        if not force and up_to_date(job, configuration_path):
+            row["status"] = "skipped"
+            if job["labels"] is not None:
+                result = load_result(job)
+                row.update(
+                    result
+                    if result is not None
+                    else evaluate_output(job, configuration)
+                )
+        else:
+            os.makedirs(os.path.dirname(job["output"]) or ".", exist_ok=True)
+            partial = {
+                field: _partial_path(job[field])
+                for field in ["output", "annotation"]
+                if job[field] is not None
+            }
+            with open(job["output"] + ".log", "w") as log:
+                with contextlib.redirect_stdout(log):
+                    try:
+                        result = track(
+                            job["input"],
+                            configuration,
+                            output=partial["output"],
+                            annotation_path=partial.get("annotation"),
+                            labels_path=job["labels"],
+                        )
+                    except Exception:
+                        traceback.print_exc(file=log)
+                        raise
+            if job["labels"] is not None:
+                # the evaluation of the labels before they are rounded in the output,
+                # reused when the job is skipped
+                with open(_result_path(partial["output"]), "w") as file:
+                    json.dump(
+                        dict(
+                            {field: result[field] for field in RESULT_FIELDS},
+                            labels=job["labels"],
+                        ),
+                        file,
+                    )
+            for field, path in partial.items():
+                os.replace(path, job[field])
+            if job["labels"] is not None:
+                os.replace(_result_path(partial["output"]), _result_path(job["output"]))
+            row["status"] = "done"
+            row.update(result)
+    except Exception as error:
+        row["status"] = "failed"
+        row["error"] = "{}: {}".format(type(error).__name__, error)
+    row["seconds"] = time.perf_counter() - start_time
+    return row
+
+
+def _job_process(connection, args):
+    connection.send(run_job(*args))
+    connection.close()
+
+
+def run_jobs(tasks, processes):
+    """Runs every task, the arguments of run_job, in its own process, at most 'processes'
+    at once. Yields the index and the summary row of each task as it finishes. A process
+    that dies without a result, e.g. on a crash of the decoder, fails only its task"""
+    pending = deque(enumerate(tasks))
+    running = {}
+    while pending or running:
+        while pending and len(running) < processes:
+            k, args = pending.popleft()
+            receiver, sender = multiprocessing.Pipe(duplex=False)
+            process = multiprocessing.Process(target=_job_process, args=(sender, args))
+            process.start()
+            sender.close()
+            running[process.sentinel] = (k, args, process, receiver)
+        for sentinel in wait(list(running)):
+            k, args, process, receiver = running.pop(sentinel)
+            try:
+                row = receiver.recv()
+            except EOFError:  # the process died before sending its result
+                row = None
+            process.join()
+            if row is None:
+                row = {
+                    "input": args[0]["input"],
+                    "output": args[0]["output"],
+                    "status": "failed",
+                    "error": "process exited with code {}".format(process.exitcode),
+                    "seconds": 0.0,
+                }
+            yield k, row
+
+
+def write_summary(path, rows):
+    """Writes the summary rows as csv"""
+    with open(path, "w", newline="") as file:
+        writer = csv.DictWriter(file, fieldnames=SUMMARY_FIELDS, extrasaction="ignore")
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def main():
+    """Main function"""
+    args = parse_args(sys.argv[1:])
+    assert args.jobs >= 1
+    with open(args.configuration, "r") as file:
+        configuration = yaml.safe_load(file)
+    jobs = load_manifest(args.manifest)
+    print("Batch worm tracker - {} recordings, {} at once".format(len(jobs), args.jobs))
+
+    start_time = time.perf_counter()
+    rows = [None] * len(jobs)
+    tasks = [(job, configuration, args.configuration, args.force) for job in jobs]
+    for done, (k, row) in enumerate(run_jobs(tasks, args.jobs), start=1):
+        rows[k] = row
+        print(
+            "> [{}/{}] {}: {} in {:.1f} s{}".format(
+                done,
+                len(jobs),
+                row["input"],
+                row["status"],
+                row["seconds"],
+                ", accuracy {:.4f}".format(row["accuracy"])
+                if "accuracy" in row
+                else "",
+            )
+        )
+        if row["status"] == "failed":
+            print("    {}".format(row["error"]))
+
+    write_summary(args.summary, rows)
+    statuses = [row["status"] for row in rows]
+    evaluated = [row for row in rows if "accuracy" in row]
+    print(
+        "Finished in {:.1f} s: {} done, {} skipped, {} failed.".format(
+            time.perf_counter() - start_time,
+            statuses.count("done"),
+            statuses.count("skipped"),
+            statuses.count("failed"),
+        )
+    )
+    if evaluated:
+        count = sum(row["count"] for row in evaluated)
+        print(
+            "EVALUATION: {} frames, custom accuracy [{}]".format(
+                count, sum(row["accuracy"] * row["count"] for row in evaluated) / count
+            )
+        )
+    print("+ Summary written to {}.".format(args.summary))
+    if statuses.count("failed"):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
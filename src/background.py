@@ -0,0 +1,109 @@
+"""Compedium of background models. All of them have the interface of the OpenCV background
+subtractors: 'apply' takes a single channel frame, updates the model and returns the
+foreground mask (255 foreground, 0 background). The mask is written to 'fgmask' if
+given, which may be the frame itself"""
+import numpy as np
+import cv2
+
+from src.vibe.vibe import ViBe
+
+
+class BackgroundModel:
+    """Interface of the background models"""
+
+    def apply(self, image, fgmask=None):
+        """Returns the foreground mask of the frame and updates the model"""
+        raise NotImplementedError
+
+
+class TemporalMedian(BackgroundModel):
+    """Background computed as the median of a set of sampled frames. A frame is sampled
+    every 'interval' frames, keeping the last 'samples' ones, and the median is only
+    recomputed when a new frame is sampled"""
+
+    def __init__(self, samples=15, interval=20, threshold=20):
+        self.samples = samples
+        self.interval = interval
+        self.threshold = threshold
+        self._bank = None
+        self._background = None
+        self._sampled = 0
+        self._frame_no = 0
+
+    def apply(self, image, fgmask=None):
+        """Returns the foreground mask of the frame and updates the model"""
+        if self._bank is None or self._bank.shape[1:] != image.shape:
+            self._bank = np.empty((self.samples,) + image.shape, dtype=np.uint8)
+            self._sampled = self._frame_no = 0
+        if self._frame_no % self.interval == 0:
+            self._bank[self._sampled % self.samples] = image
+            self._sampled += 1
+            self._background = np.median(
+                self._bank[: min(self._sampled, self.samples)], axis=0
+            ).astype(np.uint8)
+        self._frame_no += 1
+        mask = cv2.absdiff(image, self._background, dst=fgmask)
+        cv2.threshold(mask, self.threshold, 255, cv2.THRESH_BINARY, dst=mask)
+        return mask
+
+
+class RunningAverage(BackgroundModel):
+    """Background computed as the exponential running average of the frames, with
+    learning rate 'alpha'"""
+
+    def __init__(self, alpha=0.01, threshold=20):
+        self.alpha = alpha
+        self.threshold = threshold
+        self._average = None
+        self._background = None
+
+    def apply(self, image, fgmask=None):
+        """Returns the foreground mask of the frame and updates the model"""
+        if self._average is None or self._average.shape != image.shape:
+            self._average = image.astype(np.float32)
+            self._background = image.copy()
+        # the average is updated first, as the mask may overwrite the frame
+        cv2.accumulateWeighted(image, self._average, self.alpha)
+        mask = cv2.absdiff(image, self._background, dst=fgmask)
+        cv2.threshold(mask, self.threshold, 255, cv2.THRESH_BINARY, dst=mask)
+        cv2.convertScaleAbs(self._average, dst=self._background)
+        return mask
+
+
+def create_background_model(configuration):
+    """Creates the background model specified by the 'background_subtraction' configuration"""
+    method = configuration.get("method", "mog2")
+    if method == "mog2":
+        model = cv2.createBackgroundSubtractorMOG2(
+            history=configuration["history"],
+            varThreshold=configuration["varTreshold"],
+            detectShadows=False,
+        )
+        model.setNMixtures(configuration["NMixtures"])
+    elif method == "knn":
+        model = cv2.createBackgroundSubtractorKNN(
+            history=configuration["history"],
+            dist2Threshold=configuration["knn"]["dist2Threshold"],
+            detectShadows=False,
+        )
+    elif method == "vibe":
+        model = ViBe(
+            samples=configuration["vibe"]["samples"],
+            threshold=configuration["vibe"]["threshold"],
+            matches=configuration["vibe"]["matches"],
+            update_factor=configuration["vibe"]["update_factor"],
+        )
+    elif method == "median":
+        model = TemporalMedian(
+            samples=configuration["median"]["samples"],
+            interval=configuration["median"]["interval"],
+            threshold=configuration["median"]["threshold"],
+        )
+    elif method == "average":
+        model = RunningAverage(
+            alpha=configuration["average"]["alpha"],
+            threshold=configuration["average"]["threshold"],
+        )
+    else:
+        raise Exception("Unknown background subtraction method: " + method)
+    return model
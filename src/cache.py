@@ -0,0 +1,229 @@
+"""On-disk cache of the outputs of the stages of the tracker, addressed by a key built from
+the content of the input and the configuration each stage depends on. Least recently used
+entries are evicted beyond a size limit"""
+import os
+import json
+import shutil
+import hashlib
+
+import pandas as pd
+
+from src.capture import LazyCapture, FrameWriter
+from src.trajectory import Trajectory
+
+
+def fingerprint(path, blocks=16, block_size=2**16):
+    """Returns a digest of the content of the file: its size and 'blocks' evenly spaced
+    blocks of 'block_size' bytes. Unlike the mtime, it survives copies of the file, and
+    unlike a full hash it is cheap for long videos"""
+    size = os.path.getsize(path)
+    digest = hashlib.sha256(str(size).encode())
+    with open(path, "rb") as file:
+        for k in range(blocks):
+            file.seek(max(size - block_size, 0) * k // max(blocks - 1, 1))
+            digest.update(file.read(block_size))
+    return digest.hexdigest()
+
+
+def stage_key(parent, *configurations):
+    """Returns the key of a stage from the key of the stage it depends on (or the
+    fingerprint of the input) and the configurations that affect it"""
+    content = json.dumps([parent, configurations], sort_keys=True, default=str)
+    return hashlib.sha256(content.encode()).hexdigest()[:32]
+
+
+def _size(path):
+    if not os.path.isdir(path):
+        return os.path.getsize(path)
+    return sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, names in os.walk(path)
+        for name in names
+    )
+
+
+def _alive(pid):
+    if os.name == "nt":  # os.kill would terminate the process
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:  # the process of another user
+        return True
+    return True
+
+
+def _remove(path):
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+class StageCache:
+    """Cache of stage outputs in 'directory', at most 'max_bytes' of them. Data frames
+    are pickled, labels saved as trajectories (.trj) and frames as sequences of .npy
+    files. Entries are written under a temporary name and renamed once complete, so an
+    interrupted run never leaves a partial entry. The cache can be shared by concurrent
+    processes: the frames being read, lazily, are leased and not evicted until the
+    process releases them or exits (removing the other entries doesn't affect their
+    readers, which hold them open). A cache without directory is disabled: every stage
+    is computed"""
+
+    _EXTENSIONS = {"frames": "", "dataframe": ".pkl", "trajectory": ".trj"}
+
+    def __init__(self, directory=None, max_bytes=None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = []  # stages loaded from the cache
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+            self.evict()  # the limit may have been lowered
+
+    def enabled(self):
+        return self.directory is not None
+
+    def path(self, stage, key, kind):
+        return os.path.join(
+            self.directory, "{}-{}{}".format(stage, key, self._EXTENSIONS[kind])
+        )
+
+    def contains(self, stage, key, kind):
+        """Returns whether the output of the stage is cached"""
+        return self.enabled() and os.path.exists(self.path(stage, key, kind))
+
+    def load(self, stage, key, kind):
+        """Returns the cached output of the stage, or None"""
+        if not self.enabled():
+            return None
+        path = self.path(stage, key, kind)
+        if kind == "frames":  # before it is listed, so that it isn't evicted meanwhile
+            self._lease(path)
+        try:
+            if kind == "frames":
+                value = LazyCapture.load_sequence(path)
+            elif kind == "dataframe":
+                value = pd.read_pickle(path)
+            else:
+                value = Trajectory.open(path)
+        except Exception:  # missing, evicted meanwhile or unreadable
+            return None
+        os.utime(path)  # most recently used
+        self.hits.append(stage)
+        return value
+
+    def store(self, stage, key, kind, value):
+        """Caches the output of a stage (a data frame or a trajectory)"""
+        if not self.enabled():
+            return
+        path = self.path(stage, key, kind)
+        temporary = self._temporary(path)
+        try:
+            if kind == "dataframe":
+                value.to_pickle(temporary)
+            else:
+                value.save(temporary)
+            os.replace(temporary, path)
+        except OSError:  # e.g. no space left, the stage just isn't cached
+            _remove(temporary)
+            return
+        self.evict()
+
+    def get(self, stage, key, kind, compute):
+        """Returns the cached output of the stage, or computes and caches it"""
+        value = self.load(stage, key, kind)
+        if value is None:
+            value = compute()
+            self.store(stage, key, kind, value)
+        return value
+
+    def tap_frames(self, stage, key, capture):
+        """Caches the frames of the capture as they are iterated, the entry is complete
+        once 'commit' is called after the last one. Returns the capture and 'commit'"""
+        if not self.enabled() or (
+            self.max_bytes is not None
+            and capture.length() * capture.W() * capture.H() * capture.C()
+            > self.max_bytes
+        ):
+            return capture, lambda: None
+        path = self.path(stage, key, "frames")
+        temporary = self._temporary(path)
+        writer = FrameWriter(temporary, capture.W(), capture.H(), fourcc="NPY")
+        expected = capture.length()
+
+        def write_frame(i, frame):
+            writer.write(i, frame)
+            return frame
+
+        def commit():
+            try:
+                info = writer.close()
+                if info["frames"] != expected:  # not every frame was iterated
+                    raise OSError("incomplete frames")
+                os.replace(temporary, path)
+            except OSError:
+                _remove(temporary)
+                return
+            self.evict()
+
+        capture.apply(write_frame, name="cache")
+        return capture, commit
+
+    def evict(self):
+        """Removes the partial entries and leases of the processes that exited, then the
+        least recently used entries until the cache fits in 'max_bytes'"""
+        if not self.enabled() or self.max_bytes is None:
+            return
+        names = os.listdir(self.directory)
+        leased = set()
+        for name in names:
+            if name.startswith("lease-"):
+                pid, entry = name[len("lease-") :].split("-", 1)
+                if _alive(int(pid)):
+                    leased.add(entry)
+                else:  # the reader exited without releasing it
+                    _remove(os.path.join(self.directory, name))
+        entries = []
+        for name in names:
+            if name.startswith("tmp-"):
+                pid = name[len("tmp-") :].split("-", 1)[0]
+                if not _alive(int(pid)):  # left by a run that crashed or was killed
+                    _remove(os.path.join(self.directory, name))
+                continue
+            if name.startswith("lease-") or name in leased:  # in use
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                entries.append((os.path.getmtime(path), _size(path), path))
+            except OSError:  # removed meanwhile
+                pass
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            _remove(path)
+            total -= size
+
+    def release(self):
+        """Releases the frames leased by this process, which can be evicted again"""
+        if not self.enabled():
+            return
+        prefix = "lease-{}-".format(os.getpid())
+        for name in os.listdir(self.directory):
+            if name.startswith(prefix):
+                _remove(os.path.join(self.directory, name))
+
+    def _lease(self, path):
+        lease = os.path.join(
+            self.directory, "lease-{}-{}".format(os.getpid(), os.path.basename(path))
+        )
+        try:
+            open(lease, "a").close()
+        except OSError:
+            pass
+
+    def _temporary(self, path):
+        return os.path.join(
+            self.directory, "tmp-{}-{}".format(os.getpid(), os.path.basename(path))
+        )
@@ -1,9 +1,18 @@
 """Classes to manipulate captures"""
+import os
+import sys
 import copy
+import glob
+import time
+import queue
+import threading
 import itertools as it
+from collections import OrderedDict, deque
 import numpy as np
 import cv2
 
+from src.sidecar import load_sidecar
+
 
 def _take(it, n):
     tmp = [next(it) for _ in range(n)]
@@ -16,21 +25,454 @@ def _skip(it, n):
     return it
 
 
+def _batch(frames, batch_size):
+    """Groups the frames into contiguous batches of at most 'batch_size' frames"""
+    while True:
+        chunk = list(it.islice(frames, batch_size))
+        if not chunk:
+            return
+        yield np.array([i for i, _ in chunk]), np.stack([frame for _, frame in chunk])
+
+
+def load_seek_index(path):
+    """Returns the timestamp (msec) of every frame of a video. The index is built with a
+    single sequential pass the first time and persisted next to the video (see
+    load_sidecar)"""
+
+    def scan():
+        cap = cv2.VideoCapture(path)
+        msec = []
+        while cap.grab():
+            msec.append(cap.get(cv2.CAP_PROP_POS_MSEC))
+        cap.release()
+        return {"msec": np.array(msec, dtype=np.float64)}
+
+    return load_sidecar(path, ".idx.npz", scan)["msec"]
+
+
+def _video_seek(path, start=0, stop=None):
+    """Creates a function that returns the frame whose index is 'frame_no' by seeking
+    directly to it. Consecutive lookups reuse the opened video, so that reading the
+    next frame doesn't seek at all"""
+    state = {"cap": None, "next": None, "msec": None}
+
+    def _landed(cap):
+        # index of the frame that has just been grabbed, according to its timestamp
+        msec = state["msec"]
+        pos = int(np.searchsorted(msec, cap.get(cv2.CAP_PROP_POS_MSEC) - 1e-3))
+        return min(pos, len(msec) - 1)
+
+    def _inner(frame_no):
+        if state["msec"] is None:
+            state["msec"] = load_seek_index(path)
+        _stop = len(state["msec"]) if stop is None else min(stop, len(state["msec"]))
+        if not start <= frame_no < _stop:
+            raise KeyError(frame_no)
+        if state["cap"] is None:
+            state["cap"] = cv2.VideoCapture(path)
+        cap = state["cap"]
+        if state["next"] != frame_no:
+            target = frame_no
+            while True:
+                cap.set(cv2.CAP_PROP_POS_FRAMES, target)
+                if not cap.grab():
+                    raise KeyError(frame_no)
+                landed = _landed(cap)
+                if landed <= frame_no:
+                    break
+                target = max(target - 2 * (landed - frame_no), 0)  # overshot, go back
+            while landed < frame_no:
+                if not cap.grab():
+                    raise KeyError(frame_no)
+                landed = landed + 1
+        elif not cap.grab():
+            raise KeyError(frame_no)
+        ret, frame = cap.retrieve()
+        if not ret:
+            raise KeyError(frame_no)
+        state["next"] = frame_no + 1
+        return frame
+
+    return _inner
+
+
+def _prefetch(cap, start, stop, shape, depth, borrow=False):
+    """Decodes the frames ['start', 'stop') of an opened video on a background thread,
+    at most 'depth' frames ahead of the consumer. The frames are read into preallocated
+    buffers: if 'borrow', a ring of buffers is reused and each frame is only valid until
+    the next one is requested; otherwise every frame is a new array owned by the consumer"""
+    ready = queue.Queue(maxsize=depth)
+    free = queue.Queue()
+    if borrow:  # being decoded, waiting in 'ready' and held by the consumer
+        for _ in range(depth + 2):
+            free.put(np.empty(shape, dtype=np.uint8))
+    state = {"stop": False, "error": None}
+
+    def _decode():
+        try:
+            frame_no = start
+            while frame_no < stop and not state["stop"]:
+                buffer = free.get() if borrow else np.empty(shape, dtype=np.uint8)
+                if buffer is None:
+                    break
+                ret, frame = cap.read(buffer)
+                if not ret:
+                    break
+                ready.put((frame_no, frame))
+                frame_no = frame_no + 1
+        except Exception as error:  # raised by the consumer
+            state["error"] = error
+        finally:
+            cap.release()
+            ready.put(None)
+
+    thread = threading.Thread(target=_decode, daemon=True)
+    thread.start()
+    held, item = None, None
+    try:
+        while True:
+            item = ready.get()
+            if held is not None:  # the previous frame is released
+                free.put(held)
+                held = None
+            if item is None:
+                if state["error"] is not None:
+                    raise state["error"]
+                return
+            if borrow:
+                held = item[1]
+            yield item
+    finally:
+        state["stop"] = True
+        free.put(None)
+        while item is not None:  # unblock and wait for the decoding thread
+            item = ready.get()
+        thread.join()
+
+
+def _shuffle_order(length, block, buffer, seed=None):
+    """Returns the order in which a shuffle buffer of 'buffer' frames emits the frames,
+    when it is fed with blocks of 'block' contiguous frames in random order"""
+    if seed is None:
+        seed = np.random.randint(2**31)  # honour np.random.seed
+    rng = np.random.default_rng(seed)
+    order, pool = [], []
+    for block_start in rng.permutation(np.arange(0, length, block)):
+        pool.extend(range(block_start, min(block_start + block, length)))
+        while len(pool) > buffer:
+            k = rng.integers(len(pool))
+            pool[k], pool[-1] = pool[-1], pool[k]
+            order.append(pool.pop())
+    rng.shuffle(pool)
+    order.extend(pool)
+    return order
+
+
+class FrameCache:
+    """Memory bounded store of the frames produced by a LazyCapture. It behaves as the
+    'frames' function of a capture: once a full pass has been stored, later passes (in
+    either direction) are served from memory. Frames are stored until 'max_bytes' is
+    reached, then no longer admitted rather than evicting the ones stored, so that
+    sequential passes don't thrash: a later pass only computes the frames up to the
+    stored ones that end it, and serves those from memory"""
+
+    def __init__(self, frames, max_bytes=None):
+        self._source = frames
+        self._max_bytes = max_bytes
+        self._store = OrderedDict()
+        self._index = None  # indices in forward order, known after a full pass
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __call__(self, reverse=False):
+        if self.complete():
+            return self._cached(reverse)
+        return self._compute(reverse)
+
+    def complete(self):
+        """Returns whether every frame of the capture is stored"""
+        return self._index is not None and len(self._store) == len(self._index)
+
+    def index(self):
+        """Returns the indices of the frames in forward order, or None if not yet known"""
+        return self._index
+
+    def get(self, index):
+        """Returns the stored frame whose index is 'index', or None if it is not stored"""
+        frame = self._store.get(index, None)
+        if frame is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._store.move_to_end(index)
+        return frame.copy()
+
+    def info(self):
+        """Returns the counters of the cache"""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "frames": len(self._store),
+            "nbytes": self.nbytes,
+            "max_bytes": self._max_bytes,
+            "complete": self.complete(),
+        }
+
+    def clear(self):
+        """Drops every stored frame"""
+        self._store.clear()
+        self._index = None
+        self.nbytes = 0
+
+    def _cached(self, reverse):
+        for i in reversed(self._index) if reverse else self._index:
+            frame = self._store.get(i, None)
+            if frame is None:  # cleared meanwhile
+                yield from _skip_until(self._compute(reverse), i)
+                return
+            self.hits += 1
+            self._store.move_to_end(i)
+            yield i, frame.copy()
+
+    def _compute(self, reverse):
+        tail = self._stored_tail(reverse)
+        index = []
+        for i, frame in self._source(reverse=reverse):
+            if tail and i == tail[0]:  # the remaining frames are stored
+                for i in tail:
+                    self.hits += 1
+                    yield i, self._store[i].copy()
+                return
+            self.misses += 1
+            self._put(i, frame)
+            index.append(i)
+            yield i, frame
+        self._index = index[::-1] if reverse else index
+
+    def _stored_tail(self, reverse):
+        """Returns the stored frames that end a pass, in the order of the pass"""
+        if self._index is None:
+            return []
+        order = self._index[::-1] if reverse else self._index
+        k = len(order)
+        while k > 0 and order[k - 1] in self._store:
+            k = k - 1
+        return order[k:]
+
+    def _put(self, i, frame):
+        if i in self._store:
+            return
+        if self._max_bytes is not None and self.nbytes + frame.nbytes > self._max_bytes:
+            return  # full, the frames stored so far are kept
+        self._store[i] = frame.copy()  # downstream operations may modify it in place
+        self.nbytes += frame.nbytes
+
+
+class FrameTee:
+    """Splits the frames produced by a LazyCapture among several branches, so that a
+    single forward pass feeds all of them. The frames pulled by one branch are kept for
+    the others until they consume them; beyond 'max_bytes', only their indices are kept
+    and they are seeked again when needed, if the capture is seekable"""
+
+    def __init__(self, frames, n, seek=None, max_bytes=None, copy=True):
+        self._source = frames
+        self._seek = seek if max_bytes is not None else None
+        self._max_bytes = max_bytes
+        self._copy = copy
+        self._iterator = None
+        self._buffers = [deque() for _ in range(n)]
+        self._started = set()
+        self._closed = set()
+        self.nbytes = 0
+        self.peak_nbytes = 0
+        self.decoded = 0
+        self.seeked = 0
+
+    def branch(self, k):
+        """Returns the 'frames' function of the k-th branch. Its first forward pass is
+        served by the shared pass, any other pass is computed on its own"""
+
+        def frames(reverse=False):
+            if reverse or k in self._started:
+                return self._source(reverse=reverse)
+            self._started.add(k)
+            if self._iterator is None:
+                self._iterator = self._source(reverse=False)
+            return self._pull(k)
+
+        return frames
+
+    def info(self):
+        """Returns the counters of the tee"""
+        return {
+            "decoded": self.decoded,
+            "seeked": self.seeked,
+            "buffered": sum(len(buffer) for buffer in self._buffers),
+            "nbytes": self.nbytes,
+            "peak_nbytes": self.peak_nbytes,
+        }
+
+    def _pull(self, k):
+        buffer = self._buffers[k]
+        try:
+            while True:
+                if buffer:
+                    i, frame = buffer.popleft()
+                    if frame is None:
+                        self.seeked += 1
+                        frame = self._seek(i)
+                    else:
+                        self.nbytes -= frame.nbytes
+                    yield i, frame
+                    continue
+                try:
+                    i, frame = next(self._iterator)
+                except StopIteration:
+                    return
+                self.decoded += 1
+                self._share(k, i, frame)
+                yield i, frame
+        finally:  # the branch won't pull anymore, stop buffering frames for it
+            self._closed.add(k)
+            self.nbytes -= sum(f.nbytes for _, f in buffer if f is not None)
+            buffer.clear()
+
+    def _share(self, k, i, frame):
+        for j, buffer in enumerate(self._buffers):
+            if j == k or j in self._closed:
+                continue
+            if self._seek is not None and self.nbytes + frame.nbytes > self._max_bytes:
+                buffer.append((i, None))
+                continue
+            # the branches may modify their frames in place
+            buffer.append((i, frame.copy() if self._copy else frame))
+            self.nbytes += frame.nbytes
+        self.peak_nbytes = max(self.peak_nbytes, self.nbytes)
+
+
+def _skip_until(frames, index):
+    """Skips the frames preceding the one whose index is 'index'"""
+    for i, frame in frames:
+        if i == index:
+            yield i, frame
+            yield from frames
+            return
+
+
+class FrameWriter:
+    """Writes frames from a background thread fed by a queue of at most 'queue_size'
+    frames, so that encoding overlaps with the computation of the next frames. 'fourcc'
+    selects the codec of the video, e.g. "MJPG" or the lossless "FFV1", or "NPY" to
+    write a lossless sequence of .npy files in the directory 'path'. Single channel
+    frames are written as grayscale. Frames are copied when queued, as they may be
+    reused buffers, only valid until the next frame is requested"""
+
+    def __init__(self, path, W, H, fps=50, fourcc="MJPG", queue_size=16):
+        self._path = path
+        self._size = (W, H)
+        self._fps = fps
+        self._fourcc = fourcc
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._error = None
+        self.frames = 0
+        self.wait_s = 0.0  # time spent waiting for the queue, i.e. back-pressure
+        self.encode_s = 0.0
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def write(self, i, frame):
+        """Queues the frame whose index is 'i', waits if the queue is full"""
+        if self._error is not None:
+            raise self._error
+        start = time.perf_counter()
+        self._queue.put((i, frame.copy()))
+        self.wait_s += time.perf_counter() - start
+        self.frames += 1
+
+    def close(self):
+        """Waits until every queued frame is written, returns the counters"""
+        self._queue.put(None)
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
+        return self.info()
+
+    def info(self):
+        """Returns the counters of the writer"""
+        return {
+            "frames": self.frames,
+            "wait_s": self.wait_s,
+            "encode_s": self.encode_s,
+        }
+
+    def _run(self):
+        out = None
+        try:
+            if self._fourcc == "NPY":
+                os.makedirs(self._path, exist_ok=True)
+            else:
+                out = cv2.VideoWriter(
+                    self._path,
+                    cv2.VideoWriter_fourcc(*self._fourcc),
+                    self._fps,
+                    self._size,
+                )
+            while True:
+                item = self._queue.get()
+                if item is None:
+                    return
+                start = time.perf_counter()
+                i, frame = item
+                if out is None:
+                    np.save(os.path.join(self._path, "{:08d}.npy".format(i)), frame)
+                else:
+                    if frame.ndim == 2 or frame.shape[2] == 1:
+                        frame = cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR)
+                    out.write(frame)
+                self.encode_s += time.perf_counter() - start
+        except Exception as error:  # raised by the producer on its next write
+            self._error = error
+            while self._queue.get() is not None:  # unblock the producer
+                pass
+        finally:
+            if out is not None:
+                out.release()
+
+
 class LazyCapture:
     """Lazy abstraction of a set of ordered frames, enables to manipulate it at a high level"""
 
     # Constructor
-    def __init__(self, length, W, H, C, frames):  # assume the parameters are correct
+    def __init__(
+        self, length, W, H, C, frames, seek=None
+    ):  # assume the parameters are correct
         self._length = length
         self._W = W
         self._H = H
         self._C = C
         self._frames = frames
+        self._seek = seek
+        self._batches = None  # (batches function, batch size) of the last apply_batch
+        self._profiler = None
 
     # Factories
     @classmethod
-    def load(cls, path):
-        """Loads frames from avi file or folder of jpeg, returns a capture"""
+    def load(
+        cls,
+        path,
+        start=0,
+        stop=None,
+        reverse_buffer=256 * 2**20,
+        prefetch=0,
+        borrow=False,
+    ):
+        """Loads frames from avi file or folder of jpeg, returns a capture. If given, only
+        the frames in the range ['start', 'stop') are loaded, keeping their original indices.
+        Reverse iteration decodes forward blocks of at most 'reverse_buffer' bytes and
+        emits each of them backwards. If 'prefetch' > 0, forward iteration decodes up to
+        that many frames ahead on a background thread, and if 'borrow' the frames are
+        reused buffers, only valid until the next one is requested (see _prefetch)"""
         length, W, H, C = None, None, None, None
         cap = cv2.VideoCapture(path)
         ret, _ = cap.read()
@@ -45,13 +487,21 @@ class LazyCapture:
                 3,
             )
         cap.release()
+        stop = length if stop is None else min(stop, length)
+        assert 0 <= start <= stop, "[{}, {}) is not a valid range".format(start, stop)
+        length = stop - start
 
         def frames(reverse=False):
             def _ahead():
                 cap = cv2.VideoCapture(path)
-                frame_no = 0
+                frame_no = start
+                if start > 0:
+                    cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+                if prefetch > 0:
+                    yield from _prefetch(cap, start, stop, (H, W, C), prefetch, borrow)
+                    return
                 ret, frame = cap.read()
-                while ret:
+                while ret and frame_no < stop:
                     yield frame_no, frame
                     frame_no = frame_no + 1
                     ret, frame = cap.read()
@@ -59,23 +509,50 @@ class LazyCapture:
 
             def _reverse():
                 cap = cv2.VideoCapture(path)
-                frame_no = int(cap.get(cv2.CAP_PROP_FRAME_COUNT)) - 1
-                cap.set(cv2.CAP_PROP_POS_FRAMES, frame_no)
-                ret, frame = cap.read()
-                while ret and frame_no >= 0:
-                    yield frame_no, frame
-                    frame_no = frame_no - 1
-                    cap.set(cv2.CAP_PROP_POS_FRAMES, frame_no)
-                    ret, frame = cap.read()
+                block = max(1, reverse_buffer // (W * H * C))
+                block_stop = stop
+                while block_stop > start:
+                    block_start = max(start, block_stop - block)
+                    cap.set(cv2.CAP_PROP_POS_FRAMES, block_start)
+                    buffer = []
+                    for frame_no in range(block_start, block_stop):
+                        ret, frame = cap.read()
+                        if not ret:
+                            break
+                        buffer.append((frame_no, frame))
+                    yield from reversed(buffer)
+                    block_stop = block_start
                 cap.release()
 
             return _reverse() if reverse else _ahead()
 
-        return cls(length, W, H, C, frames)
+        return cls(length, W, H, C, frames, seek=_video_seek(path, start, stop))
+
+    @classmethod
+    def load_sequence(cls, path):
+        """Loads the sequence of .npy frames written to the directory 'path' by 'write'
+        with fourcc "NPY", returns a capture"""
+        files = sorted(glob.glob(os.path.join(path, "*.npy")))
+        if not files:
+            raise Exception("Couldn't read frame sequence: " + path)
+        indices = [int(os.path.splitext(os.path.basename(f))[0]) for f in files]
+        files = dict(zip(indices, files))
+        H, W, C = np.load(files[indices[0]], mmap_mode="r").shape
+
+        def frames(reverse=False):
+            for i in reversed(indices) if reverse else indices:
+                yield i, np.load(files[i])
+
+        def seek(frame_no):
+            return np.load(files[frame_no])
+
+        return cls(len(indices), W, H, C, frames, seek=seek)
 
     @classmethod
-    def random_load(cls, path):
-        """Loads frames from avi file or folder of jpeg, in a random order, returns a capture"""
+    def random_load(cls, path, seed=None, block=16, buffer=256):
+        """Loads frames from avi file or folder of jpeg, in a random order, returns a capture.
+        Contiguous blocks of 'block' frames are decoded sequentially, in random order, and
+        mixed through a shuffle buffer of 'buffer' frames. The order is fixed by 'seed'"""
         length, W, H, C = None, None, None, None
         cap = cv2.VideoCapture(path)
         ret, _ = cap.read()
@@ -91,28 +568,27 @@ class LazyCapture:
             )
         cap.release()
 
-        perm = list(np.random.permutation(np.arange(length)))
+        order = _shuffle_order(length, block, buffer, seed)
 
         def frames(reverse=False):
-            def _ahead():
-                cap = cv2.VideoCapture(path)
-                for frame_no in perm:
-                    cap.set(cv2.CAP_PROP_POS_FRAMES, frame_no)
-                    _, frame = cap.read()
-                    yield frame_no, frame
-                cap.release()
-
-            def _reverse():
+            def _shuffled(order):
                 cap = cv2.VideoCapture(path)
-                for frame_no in reversed(perm):
-                    cap.set(cv2.CAP_PROP_POS_FRAMES, frame_no)
-                    _, frame = cap.read()
-                    yield frame_no, frame
+                decoded = {}
+                for frame_no in order:
+                    if frame_no not in decoded:
+                        block_start = frame_no - frame_no % block
+                        cap.set(cv2.CAP_PROP_POS_FRAMES, block_start)
+                        for j in range(block_start, min(block_start + block, length)):
+                            ret, frame = cap.read()
+                            if not ret:
+                                break
+                            decoded[j] = frame
+                    yield frame_no, decoded.pop(frame_no, None)
                 cap.release()
 
-            return _reverse() if reverse else _ahead()
+            return _shuffled(reversed(order)) if reverse else _shuffled(order)
 
-        return LazyCapture(length, W, H, C, frames)
+        return LazyCapture(length, W, H, C, frames, seek=_video_seek(path))
 
     @classmethod
     def concat(cls, captures):
@@ -162,25 +638,52 @@ class LazyCapture:
     # Misc
     def clone(self):
         """Returns a clone the capture"""
-        return LazyCapture(self._length, self._W, self._H, self._C, self._frames)
-
-    def write(self, path, fps=50, limit=None, reverse=False):
-        """Writes the set of ordered frames into an avi file"""
-        if self._length:
-            assert self._C == 3, "C != 3"
-            out = cv2.VideoWriter(
-                path,
-                cv2.VideoWriter_fourcc("M", "J", "P", "G"),
-                fps,
-                (self._W, self._H),
-            )
-            for _, frame in (
+        capture = LazyCapture(
+            self._length, self._W, self._H, self._C, self._frames, seek=self._seek
+        )
+        capture._batches = self._batches
+        capture._profiler = self._profiler
+        return capture
+
+    def tee(self, n=2, max_bytes=None, copy=True):
+        """Returns 'n' captures that share a single pass over the frames of this one, e.g.
+        a processing branch and a branch of the raw frames. Frames are kept only until
+        every branch has consumed them, at most 'max_bytes' of them if the capture is
+        seekable (see FrameTee). This capture shouldn't be iterated anymore"""
+        tee = FrameTee(self._frames, n, self._seek, max_bytes, copy)
+        branches = []
+        for k in range(n):
+            branch = self.clone()
+            branch._frames = tee.branch(k)
+            branch._batches = None
+            branches.append(branch)
+        return branches
+
+    def write(
+        self, path, fps=50, limit=None, reverse=False, fourcc="MJPG", queue_size=16
+    ):
+        """Writes the set of ordered frames into a video file, encoded with 'fourcc', or
+        as a sequence of .npy files if 'fourcc' is "NPY" (see FrameWriter). Returns the
+        counters of the writer, including the time spent waiting for the encoder. An
+        empty capture writes nothing"""
+        if not self._length:
+            return {"frames": 0, "wait_s": 0.0, "encode_s": 0.0}
+        assert self._C in (1, 3), "C not in (1, 3)"
+        out = FrameWriter(path, self._W, self._H, fps, fourcc, queue_size)
+        try:
+            for i, frame in (
                 it.islice(self._frames(reverse=reverse), limit)
                 if limit is not None
                 else self._frames(reverse=reverse)
             ):
-                out.write(frame)
-            out.release()
+                out.write(i, frame)
+        except BaseException:
+            try:
+                out.close()
+            except Exception as error:  # the error of the loop is the one raised
+                print("Couldn't close {}: {}".format(path, error), file=sys.stderr)
+            raise
+        return out.close()
 
     def __str__(self):
         return "LazyCapture[length = {}; shape = {}]".format(
@@ -204,9 +707,24 @@ class LazyCapture:
         """Returns the number of channels of the frames"""
         return self._C
 
+    def seekable(self):
+        """Returns whether single frames can be accessed without iterating over the
+        capture. Operations that carry an accumulator (e.g. background subtraction) or
+        depend on neighbouring frames make random access fall back to a linear scan"""
+        return self._seek is not None
+
     def frame(self, frame_no, index=True):
         """Returns the 'frame_no'-th of the capture, or the frame whose index is 'frame_no'"""
         if index:
+            if isinstance(self._frames, FrameCache):
+                frame = self._frames.get(frame_no)
+                if frame is not None:
+                    return frame
+            if self._seek is not None:
+                try:
+                    return self._seek(frame_no)
+                except KeyError:
+                    assert False, "{} not in frames".format(frame_no)
             for i, frame in self._frames(reverse=False):
                 if i == frame_no:
                     return frame
@@ -223,20 +741,29 @@ class LazyCapture:
         """Returns a dictionary with the frames"""
 
         class LazyDict:
-            def __init__(self, frames):
+            def __init__(self, frames, seek):
                 self._frames = frames
+                self._seek = seek
 
             def __getitem__(self, index):
+                if isinstance(self._frames, FrameCache):
+                    frame = self._frames.get(index)
+                    if frame is not None:
+                        return frame
+                if self._seek is not None:
+                    return self._seek(index)
                 for i, frame in self._frames(reverse=False):
                     if i == index:
                         return frame
                 raise KeyError
 
-        return LazyDict(self._frames)
+        return LazyDict(self._frames, self._seek)
 
     # Index
     def index(self):
         """Returns an iterator of the indices of the frames"""
+        if isinstance(self._frames, FrameCache) and self._frames.index() is not None:
+            return iter(self._frames.index())
         return iter((i for i, _ in self._frames(reverse=False)))
 
     def reset_index(self):
@@ -259,6 +786,8 @@ class LazyCapture:
             return _reverse() if reverse else _ahead()
 
         self._frames = frames
+        self._seek = None
+        self._batches = None
 
     # Iterators
     def frames(self, limit=None, reverse=False):
@@ -269,9 +798,39 @@ class LazyCapture:
             else self._frames(reverse=reverse)
         )
 
+    def frames_batched(self, batch_size, reverse=False):
+        """Returns an iterator of contiguous batches of at most 'batch_size' frames, as
+        pairs of an array of indices and an array of frames of shape (N, H, W, C)"""
+        if self._batches is not None and self._batches[1] == batch_size:
+            return self._batches[0](reverse=reverse)
+        return _batch(self._frames(reverse=reverse), batch_size)
+
+    # Profiling
+    def profile(self, profiler, name="decode"):
+        """Records the time spent producing the current frames as the stage 'name' of the
+        profiler, and every operation applied from now on as a stage of its own"""
+        self._frames = profiler.wrap_frames(self._frames, name)
+        self._batches = None
+        self._profiler = profiler
+
+    def _profiled(self, func, name):
+        if self._profiler is None:
+            return func
+        return self._profiler.wrap(func, name)
+
     # Operations
-    def filter(self, func):
-        """Filters the frames according to the given function"""
+    def cache(self, max_bytes=None):
+        """Caches the frames in memory, so that they are computed only once. At most
+        'max_bytes' are kept, the frames beyond them are recomputed (see FrameCache).
+        Returns the cache, whose counters can be queried with 'info()'"""
+        self._frames = FrameCache(self._frames, max_bytes)
+        self._batches = None
+        return self._frames
+
+    def filter(self, func, name=None, length=None):
+        """Filters the frames according to the given function. If the number of frames
+        kept is known, 'length', they aren't counted with a pass over the capture"""
+        func = self._profiled(func, name)
         _frames = self._frames
 
         def frames(reverse=False):
@@ -279,11 +838,23 @@ class LazyCapture:
                 if func(i, frame):
                     yield i, frame
 
-        _length = 0
-        for _ in frames(reverse=False):
-            _length = _length + 1
+        _seek = self._seek
+
+        def seek(frame_no):
+            frame = _seek(frame_no)
+            if not func(frame_no, frame):
+                raise KeyError(frame_no)
+            return frame
+
+        _length = length
+        if _length is None:
+            _length = 0
+            for _ in frames(reverse=False):
+                _length = _length + 1
         self._length = _length
         self._frames = frames
+        self._seek = seek if _seek is not None else None
+        self._batches = None
 
     def extract(self, func):
         """Returns an iterator with the results of the function passed as parameter applied to every frame"""
@@ -307,8 +878,9 @@ class LazyCapture:
                 func(i, frame)
             j = j + (-1 if reverse else 1)
 
-    def apply(self, func, zip=None, acc=None, reverse=False, shape=None):
+    def apply(self, func, zip=None, acc=None, reverse=False, shape=None, name=None):
         """Applies the function passed as parameter to every frame"""
+        func = self._profiled(func, name)
         apply_reverse = reverse
         z, a = zip is not None, acc is not None
         assert not z or len(zip) == self._length, "len(zip) {} != {}".format(
@@ -368,12 +940,65 @@ class LazyCapture:
 
             return _diff() if apply_reverse != reverse else _same()
 
+        _seek = self._seek
+
+        def seek(frame_no):
+            frame = func(frame_no, _seek(frame_no))
+            assert frame.shape == _shape, "{} != {}".format(frame.shape, _shape)
+            return frame
+
         self._frames = frames
+        # only stateless operations can be computed for a single frame
+        self._seek = seek if _seek is not None and not z and not a else None
+        self._batches = None
         if shape is not None:
             self._W, self._H, self._C = _shape[1], _shape[0], _shape[2]
 
-    def rolling(self, func, window, zip=None, acc=None, reverse=False, shape=None):
-        """Applies the function passed as parameter to a rolling window over the frames"""
+    def apply_batch(self, func, batch_size=64, shape=None, name=None):
+        """Applies the function passed as parameter to contiguous batches of at most
+        'batch_size' frames, as func(indices, frames) with frames of shape (N, H, W, C).
+        Consecutive batch operations with the same 'batch_size' don't split the batches"""
+        func = self._profiled(func, name)
+        _shape = (
+            (shape[1], shape[0], shape[2])
+            if shape is not None
+            else (self._H, self._W, self._C)
+        )
+        _frames, _batches, _seek = self._frames, self._batches, self._seek
+
+        def source(reverse=False):
+            if _batches is not None and _batches[1] == batch_size:
+                return _batches[0](reverse=reverse)
+            return _batch(_frames(reverse=reverse), batch_size)
+
+        def batches(reverse=False):
+            for indices, block in source(reverse=reverse):
+                block = np.ascontiguousarray(func(indices, block))
+                assert block.shape[1:] == _shape, "{} != {}".format(
+                    block.shape[1:], _shape
+                )
+                yield indices, block
+
+        def frames(reverse=False):
+            for indices, block in batches(reverse=reverse):
+                yield from zip(indices.tolist(), block)
+
+        def seek(frame_no):
+            return func(np.array([frame_no]), _seek(frame_no)[np.newaxis])[0]
+
+        self._frames = frames
+        self._seek = seek if _seek is not None else None
+        self._batches = (batches, batch_size)
+        if shape is not None:
+            self._W, self._H, self._C = _shape[1], _shape[0], _shape[2]
+
+    def rolling(
+        self, func, window, zip=None, acc=None, reverse=False, shape=None, name=None
+    ):
+        """Applies the function passed as parameter to a rolling window over the frames.
+        The window holds the frames, which mustn't be reused buffers (see load and
+        extract_channel)"""
+        func = self._profiled(func, name)
         rolling_reverse = reverse
         assert window % 2 == 1, "window is not even"
         assert self._length >= window, "windos is too large, {} > {}".format(
@@ -451,6 +1076,8 @@ class LazyCapture:
 
         self._length = self._length - 2 * half_window
         self._frames = frames
+        self._seek = None
+        self._batches = None
         if shape is not None:
             self._W, self._H, self._C = _shape[1], _shape[0], _shape[2]
 
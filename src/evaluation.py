@@ -1,6 +1,9 @@
-"""Evaluation function plus compedium of various metrics"""
+"""Evaluation function plus compedium of various metrics. The metrics take arrays of true
+and predicted positions, of shape (..., 2), and return the score of every position"""
 import numpy as np
 
+from src.labels import to_trajectory
+
 
 def custom_accuracy(small_radix=10, big_radix=10):
     """Custom accuracy, using ell infinity norm. The estimation obtains 1 if it is closer
@@ -8,14 +11,11 @@ def custom_accuracy(small_radix=10, big_radix=10):
 
     def _inner(tl, pl):
         def ell_inf_dist(p1, p2):
-            return max(np.abs(p1[0] - p2[0]), np.abs(p1[1] - p2[1]))
+            dx, dy = np.abs(p1[..., 0] - p2[..., 0]), np.abs(p1[..., 1] - p2[..., 1])
+            return np.where(dy > dx, dy, dx)  # as max(dx, dy), also with NaN
 
         tmp = ell_inf_dist(tl, pl)
-        if tmp <= small_radix:
-            return 1.0
-        elif tmp <= big_radix:
-            return 0.5
-        return 0.0
+        return np.where(tmp <= small_radix, 1.0, np.where(tmp <= big_radix, 0.5, 0.0))
 
     return _inner
 
@@ -25,17 +25,83 @@ def distance():
 
     def _inner(tl, pl):
         def manhattan_dist(p1, p2):
-            return abs(p1[0] - p2[0]) + abs(p1[1] - p2[1])
+            return np.abs(p1[..., 0] - p2[..., 0]) + np.abs(p1[..., 1] - p2[..., 1])
 
         return manhattan_dist(tl, pl)
 
     return _inner
 
 
+def euclidean_distance():
+    """Euclidean distance"""
+
+    def _inner(tl, pl):
+        return np.hypot(tl[..., 0] - pl[..., 0], tl[..., 1] - pl[..., 1])
+
+    return _inner
+
+
+def align(true_labels, pred_labels):
+    """Joins two sets of labels, dictionaries or Trajectory, on their frames. Returns the
+    frames in common and the true and predicted positions, of shape (N, 2)"""
+    true_labels, pred_labels = to_trajectory(true_labels), to_trajectory(pred_labels)
+    true_k, pred_k = _join(true_labels.frames, pred_labels.frames)
+    return (
+        true_labels.frames[true_k],
+        true_labels.points()[true_k],
+        pred_labels.points()[pred_k],
+    )
+
+
+def _join(true_frames, pred_frames):
+    """Sorted-index join of two increasing arrays of frames, returns the matching indices"""
+    if len(pred_frames) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    pred_k = np.minimum(np.searchsorted(pred_frames, true_frames), len(pred_frames) - 1)
+    true_k = np.flatnonzero(pred_frames[pred_k] == true_frames)
+    return true_k, pred_k[true_k]
+
+
+def errors(true_labels, pred_labels, metric_func):
+    """Returns the frames in common and the metric of each one"""
+    frames, true_points, pred_points = align(true_labels, pred_labels)
+    return frames, metric_func(true_points, pred_points)
+
+
+def _mean(scores):
+    # sequential sum in frame order, as the sum of a loop, not numpy's pairwise one
+    total = np.cumsum(scores, axis=-1)[..., -1] if scores.shape[-1] else 0.0
+    return total / scores.shape[-1]
+
+
 def evaluate(true_labels, pred_labels, metric_func):
     """Evaluates function, for a given metric"""
-    metric = 0.0
-    labels = true_labels.keys() & pred_labels.keys()
-    for i in labels:
-        metric += metric_func(true_labels[i], pred_labels[i])
-    return len(labels), metric / len(labels)
+    _, scores = errors(true_labels, pred_labels, metric_func)
+    return len(scores), float(_mean(scores))
+
+
+def evaluate_runs(true_labels, runs, metrics):
+    """Evaluates many runs, i.e. predicted labels, against the same true labels for
+    several metrics {name: metric_func}. Returns {name: [(count, mean) of each run]}.
+    Runs with the same frames, e.g. every run on the same capture, are scored at once"""
+    true_labels = to_trajectory(true_labels)
+    runs = [to_trajectory(run) for run in runs]
+    results = {name: [None] * len(runs) for name in metrics}
+
+    groups = {}
+    for k, run in enumerate(runs):
+        key = (len(run), run.frames[0] if len(run) else None)
+        group = groups.setdefault(key, [])
+        if group and not np.array_equal(runs[group[0]].frames, run.frames):
+            group = groups.setdefault((k,), [])
+        group.append(k)
+
+    for group in groups.values():
+        true_k, pred_k = _join(true_labels.frames, runs[group[0]].frames)
+        true_points = true_labels.points()[true_k]
+        pred_points = np.stack([runs[k].points()[pred_k] for k in group])
+        for name, metric_func in metrics.items():
+            means = _mean(metric_func(true_points[np.newaxis], pred_points))
+            for k, mean in zip(group, np.atleast_1d(means)):
+                results[name][k] = (len(true_k), float(mean))
+    return results
@@ -1,5 +1,6 @@
 """Compedium of functions to manipulate frames, to be used with *Capture"""
 import numpy as np
+import cv2
 
 
 def select_channel(channel):
@@ -12,6 +13,27 @@ def select_channel(channel):
     return _inner
 
 
+def extract_channel(channel, bbox=None, reuse=False):
+    """Extracts a single channel into a contiguous frame, cropped to 'bbox' (left, top,
+    right, bottom) if given. If 'reuse', the same output buffer is used for every frame,
+    so each frame is only valid until the next one is requested: consumers that hold
+    frames have to copy them (FrameWriter does)"""
+    buffers = {}
+
+    def _inner(i, frame):
+        if bbox is not None:
+            l, t, r, b = bbox
+            frame = frame[t:b, l:r]
+        H, W, _ = frame.shape
+        out = buffers.get((H, W)) if reuse else None
+        if out is None:
+            out = buffers[(H, W)] = np.empty((H, W, 1), dtype=np.uint8)
+        cv2.extractChannel(frame, channel, dst=out[:, :, 0])
+        return out
+
+    return _inner
+
+
 def plicate_channel(channels):
     """N-plicates the channels"""
 
@@ -48,33 +70,71 @@ def remove_borders(pixels, hard=False):
     return _inner
 
 
+def petri_bbox(center, radius, W, H):
+    """Returns the bounding box (left, top, right, bottom) of an elipsis, clipped to the frame"""
+    l, r = max(int(center[0] - radius[0]), 0), min(int(center[0] + radius[0]), W - 1)
+    t, b = max(int(center[1] - radius[1]), 0), min(int(center[1] + radius[1]), H - 1)
+    return l, t, r, b
+
+
+def detect_petri(frame):
+    """Detects the petri dish in a single channel frame (ideally the median of several
+    frames), returns its center and radius or None if no circle is found"""
+    H, W = frame.shape[:2]
+    circles = cv2.HoughCircles(
+        cv2.medianBlur(frame, 5),
+        cv2.HOUGH_GRADIENT,
+        dp=2,
+        minDist=min(W, H),
+        param1=100,
+        param2=50,
+        minRadius=min(W, H) // 4,
+        maxRadius=max(W, H) // 2,
+    )
+    if circles is None:
+        return None
+    x, y, r = circles[0][0]
+    return [int(round(x)), int(round(y))], [int(round(r)), int(round(r))]
+
+
+def _outside_petri(center, radius, W, H, hard):
+    """Returns the region of the frame to keep and the mask of the pixels outside of the
+    elipsis within that region"""
+    l, t, r, b = petri_bbox(center, radius, W, H) if hard else (0, 0, W, H)
+    I, J = np.ogrid[t:b, l:r]
+    dist_from_center = ((I - center[1]) / radius[1]) ** 2 + (
+        (J - center[0]) / radius[0]
+    ) ** 2
+    return (l, t, r, b), dist_from_center > 1
+
+
 def remove_outside_petri(center, radius, hard=False):
-    """Removes the part of the frame outside of an elipsis"""
+    """Removes the part of the frame outside of an elipsis. If 'hard', the frame is also
+    cropped to the bounding box of the elipsis. The mask is computed once per frame shape"""
+    masks = {}
 
     def _inner(i, frame):
         H, W, _ = frame.shape
-        I, J = np.ogrid[:H, :W]
-        dist_from_center = ((I - center[1]) / radius[1]) ** 2 + (
-            (J - center[0]) / radius[0]
-        ) ** 2
-        mask = dist_from_center <= 1
-        frame[~mask, :] = 0
+        if (H, W) not in masks:
+            masks[(H, W)] = _outside_petri(center, radius, W, H, hard)
+        (l, t, r, b), outside = masks[(H, W)]
         if hard:
-            l, r = max(center[0] - radius[0], 0), min(center[0] + radius[0], W - 1)
-            t, b = max(center[1] - radius[1], 0), min(center[1] + radius[1], H - 1)
             frame = frame[t:b, l:r]
+        np.copyto(frame, 0, where=outside[:, :, np.newaxis])
         return frame
 
     return _inner
 
 
-def annotate(labels, size=2, color=[255, 0, 0]):
-    """Annotates the frames using labels"""
+def annotate(labels, size=2, color=[255, 0, 0], offset=(0, 0)):
+    """Annotates the frames using labels, a dictionary or a Trajectory of integer
+    positions. 'offset' is the position of the frame within the frame the labels refer
+    to, e.g. the top left corner of a crop"""
 
     def _inner(i, frame):
         label = labels.get(i, None)
         if label is not None:
-            y, x = label
+            y, x = label[0] - offset[0], label[1] - offset[1]
             frame[x - size : x + size, y - size : y + size] = np.array(
                 color, dtype=np.uint8
             )
@@ -89,3 +149,48 @@ def average(i, frames):
     for frame in frames[1:]:
         base += frame[1]
     return (base / len(frames)).astype(np.uint8)
+
+
+def average_batch(indices, frames):
+    """Computes the average frame of a (N, H, W, C) batch of frames, a reducer over the
+    batches of *Capture.frames_batched (not an operation for apply_batch)"""
+    return frames.mean(axis=0, dtype=np.float32).astype(np.uint8)
+
+
+# Batch versions, to be used with *Capture.apply_batch. Each one processes a whole
+# (N, H, W, C) batch of frames with a single NumPy call
+
+
+def select_channel_batch(channel):
+    """Selects a single channel of a batch of frames"""
+
+    def _inner(indices, frames):
+        return frames[:, :, :, channel : channel + 1]
+
+    return _inner
+
+
+def cast_batch(type):
+    """Casts the type of a batch of frames"""
+
+    def _inner(indices, frames):
+        return frames.astype(type)
+
+    return _inner
+
+
+def remove_outside_petri_batch(center, radius, hard=False):
+    """Removes the part of a batch of frames outside of an elipsis, see remove_outside_petri"""
+    masks = {}
+
+    def _inner(indices, frames):
+        _, H, W, _ = frames.shape
+        if (H, W) not in masks:
+            masks[(H, W)] = _outside_petri(center, radius, W, H, hard)
+        (l, t, r, b), outside = masks[(H, W)]
+        if hard:
+            frames = frames[:, t:b, l:r]
+        frames[:, outside, :] = 0
+        return frames
+
+    return _inner
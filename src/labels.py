@@ -1,21 +1,66 @@
 """Compedium of functions to manipulate labels"""
 import numpy as np
+import pandas as pd
+
+from src.sidecar import load_sidecar
+from src.trajectory import Trajectory
+
+
+def _parse_labels(path):
+    """Parses the x, y and slice columns of a label file with the C parser of pandas.
+    When a slice is repeated in consecutive lines, the first one is kept"""
+    try:
+        data = pd.read_csv(
+            path,
+            sep=r"\s+",
+            header=None,
+            skiprows=1,
+            usecols=[5, 6, 7],
+            dtype=np.float64,
+        ).to_numpy()
+    except pd.errors.EmptyDataError:
+        data = np.zeros((0, 3))
+    slices = data[:, 2].astype(np.int64)
+    first = np.ones(len(slices), dtype=bool)
+    first[1:] = slices[1:] != slices[:-1]
+    data, slices = data[first], slices[first]
+    # a slice that appears again later keeps its last label, as in a dictionary
+    slices, last = np.unique(slices[::-1], return_index=True)
+    last = len(data) - 1 - last
+    return Trajectory(slices, data[last, 0], data[last, 1])
+
+
+def load_true_labels(path):
+    """Loads labels from a file into a Trajectory. The parsed labels are cached next to
+    the file (see load_sidecar)"""
+
+    def parse():
+        labels = _parse_labels(path)
+        return {"frames": labels.frames, "x": labels.x, "y": labels.y}
+
+    data = load_sidecar(path, ".labels.npz", parse)
+    return Trajectory(data["frames"], data["x"], data["y"])
 
 
 def load_labels(path):
     """Loads labels from a file into a dictionary"""
-    file = open(path, "r")
-    slice = -1
-    ret = {}
-    for i, line in enumerate(file.readlines()):
-        fields = line.split()
-        if i == 0 or fields[7] == slice:
-            continue
-        true_i = float(fields[5])
-        true_j = float(fields[6])
-        slice = int(fields[7])
-        ret[slice] = (true_i, true_j)
-    return ret
+    labels = load_true_labels(path)
+    return dict(zip(labels.frames.tolist(), zip(labels.x.tolist(), labels.y.tolist())))
+
+
+def load_output_labels(path):
+    """Loads the labels written by the worm tracker, either as text or in the binary
+    trajectory format (.trj, memory mapped)"""
+    if path.endswith(".trj"):
+        return Trajectory.open(path)
+    return Trajectory.read_text(path)
+
+
+def to_trajectory(labels):
+    """Converts labels, either a dictionary or a Trajectory, to a Trajectory"""
+    if isinstance(labels, Trajectory):
+        return labels
+    return Trajectory.from_dict(labels)
 
 
 def map_labels(labels, func):
@@ -0,0 +1,132 @@
+"""Profiling of the stages of a pipeline, to be used with *Capture"""
+import time
+import json
+from array import array
+from contextlib import contextmanager, nullcontext
+
+import numpy as np
+
+
+def stage_name(func):
+    """Returns the name of the stage of a function, e.g. 'select_channel' for the
+    function returned by 'select_channel(1)'"""
+    return getattr(func, "__qualname__", type(func).__name__).split(".")[0]
+
+
+def measure(profiler, name):
+    """Returns a context manager that records the time spent within it as the stage 'name'
+    of the profiler, or does nothing if there is no profiler"""
+    return nullcontext() if profiler is None else profiler.measure(name)
+
+
+def _nbytes(result):
+    if isinstance(result, tuple):  # (frame, acc)
+        result = result[0]
+    return getattr(result, "nbytes", 0)
+
+
+class Profiler:
+    """Collects the wall time of every call to each stage of a pipeline, and the bytes
+    produced by it"""
+
+    def __init__(self):
+        self._seconds = {}
+        self._bytes = {}
+
+    def _stage(self, name):
+        if name not in self._seconds:
+            self._seconds[name] = array("d")
+            self._bytes[name] = 0
+        return name
+
+    def _unique(self, name):
+        """Returns 'name', or 'name#k' if there is already a stage with that name"""
+        k, unique = 1, name
+        while unique in self._seconds:
+            k += 1
+            unique = "{}#{}".format(name, k)
+        return self._stage(unique)
+
+    def record(self, name, seconds, result=None):
+        """Records a call to a stage"""
+        self._stage(name)
+        self._seconds[name].append(seconds)
+        self._bytes[name] += _nbytes(result)
+
+    def wrap(self, func, name=None):
+        """Returns the function wrapped so that every call is recorded as a new stage,
+        named 'name' or after the function"""
+        name = self._unique(name or stage_name(func))
+
+        def _inner(*args, **kwargs):
+            start = time.perf_counter()
+            result = func(*args, **kwargs)
+            self.record(name, time.perf_counter() - start, result)
+            return result
+
+        return _inner
+
+    def wrap_frames(self, frames, name):
+        """Returns the 'frames' function of a capture wrapped so that producing every
+        frame is recorded as a new stage named 'name'"""
+        name = self._unique(name)
+
+        def _inner(reverse=False):
+            iterator = frames(reverse=reverse)
+            while True:
+                start = time.perf_counter()
+                try:
+                    i, frame = next(iterator)
+                except StopIteration:
+                    return
+                self.record(name, time.perf_counter() - start, frame)
+                yield i, frame
+
+        return _inner
+
+    @contextmanager
+    def measure(self, name):
+        """Context manager that records the time spent within it"""
+        start = time.perf_counter()
+        yield
+        self.record(name, time.perf_counter() - start)
+
+    def merge(self, other):
+        """Adds the records of another profiler, e.g. one of a worker process"""
+        for name, seconds in other._seconds.items():
+            self._stage(name)
+            self._seconds[name].extend(seconds)
+            self._bytes[name] += other._bytes[name]
+
+    def report(self, frames=None, wall=None):
+        """Returns the totals, the latency percentiles (ms) and the throughput of every stage"""
+        stages = {}
+        for name, seconds in self._seconds.items():
+            seconds = np.frombuffer(seconds, dtype=np.float64)
+            total = float(seconds.sum())
+            p50, p90, p99 = (
+                np.percentile(seconds, [50, 90, 99]) * 1000
+                if len(seconds)
+                else (0.0, 0.0, 0.0)
+            )
+            stages[name] = {
+                "calls": len(seconds),
+                "total_s": total,
+                "bytes": self._bytes[name],
+                "p50_ms": float(p50),
+                "p90_ms": float(p90),
+                "p99_ms": float(p99),
+                "calls_per_s": len(seconds) / total if total else None,
+            }
+        report = {"stages": stages}
+        if frames is not None:
+            report["frames"] = frames
+        if wall is not None:
+            report["wall_s"] = wall
+            report["frames_per_s"] = frames / wall if frames and wall else None
+        return report
+
+    def write(self, path, frames=None, wall=None):
+        """Writes the report as json"""
+        with open(path, "w") as file:
+            json.dump(self.report(frames, wall), file, indent=2)
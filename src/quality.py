@@ -0,0 +1,72 @@
+"""Frame quality index: cheap per-frame statistics computed in a first pass over a video,
+on downsampled frames, used to skip flash, global change and duplicate frames"""
+import numpy as np
+import pandas as pd
+import cv2
+
+from src.sidecar import load_sidecar
+
+
+def compute_quality(path, scale=8, channel=1):
+    """Computes the statistics of every frame, on the given channel of frames downsampled
+    by 'scale': the mean brightness, the mean absolute difference with the previous frame
+    (the global change) and whether it is a duplicate of the previous frame"""
+    cap = cv2.VideoCapture(path)
+    W = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    H = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    size = (max(W // scale, 1), max(H // scale, 1))
+    frame = np.empty((H, W, 3), dtype=np.uint8)
+    small = np.empty((size[1], size[0], 3), dtype=np.uint8)
+    current = np.empty((size[1], size[0]), dtype=np.uint8)
+    previous = None
+    brightness, change = [], []
+    while True:
+        ret, frame = cap.read(frame)
+        if not ret:
+            break
+        cv2.resize(frame, size, dst=small, interpolation=cv2.INTER_AREA)
+        cv2.extractChannel(small, channel, dst=current)
+        brightness.append(cv2.mean(current)[0])
+        if previous is None:
+            change.append(np.nan)
+            previous = current.copy()
+        else:
+            change.append(cv2.mean(cv2.absdiff(current, previous))[0])
+            previous, current = current, previous
+    cap.release()
+    change = np.array(change, dtype=np.float64)
+    return {
+        "brightness": np.array(brightness, dtype=np.float64),
+        "change": change,
+        "duplicate": change == 0,
+    }
+
+
+def load_quality_index(path, scale=8, channel=1):
+    """Returns the statistics of every frame (see compute_quality). The index is computed
+    the first time and persisted next to the video (see load_sidecar)"""
+    return load_sidecar(
+        path,
+        ".quality.npz",
+        lambda: compute_quality(path, scale, channel),
+        key=(scale, channel),
+    )
+
+
+def bad_frames(index, configuration):
+    """Returns which frames to skip, according to the 'quality' configuration: flashes,
+    whose brightness deviates from the rolling median, global changes (except the frame
+    right after a flash) and, optionally, duplicates"""
+    brightness = pd.Series(index["brightness"])
+    median = brightness.rolling(configuration["window"], center=True, min_periods=1)
+    flash = (
+        np.abs(brightness - median.median()).to_numpy()
+        > configuration["brightness_threshold"]
+    )
+    after_flash = np.zeros_like(flash)
+    after_flash[1:] = flash[:-1]
+    change = (index["change"] > configuration["change_threshold"]) & ~after_flash
+    bad = flash | change
+    if configuration.get("skip_duplicates", False):
+        bad |= index["duplicate"]
+    return bad
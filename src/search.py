@@ -0,0 +1,91 @@
+"""Predictive search of the worm: once it is tracked, it is only located within a window
+around its predicted position"""
+import numpy as np
+
+
+class PredictiveSearch:
+    """Predicts the position of the worm from its last fixes, at constant velocity. Until
+    a candidate has been found within 'search_range' of a candidate of the previous
+    frame for 'confirm' consecutive frames, whole frames are searched. Then, only the
+    window of half side 'window' around the prediction is, until no candidate is found
+    within 'search_range' of the prediction for 'lost' consecutive frames"""
+
+    def __init__(self, window=64, search_range=25, confirm=10, lost=5):
+        self.window = window
+        self.search_range = search_range
+        self.confirm = confirm
+        self.lost = lost
+        self.full_searches = 0
+        self.window_searches = 0
+        self._reset()
+
+    def _reset(self):
+        self._target = None  # (frame, position, velocity) of the last fix
+        self._missed = 0
+        self._candidates = np.empty((0, 2))
+        self._streaks = np.empty(0, dtype=np.int64)
+
+    def tracking(self):
+        """Returns whether the worm is tracked, i.e. the search is windowed"""
+        return self._target is not None
+
+    def predict(self, frame_no):
+        """Returns the predicted (x, y) position of the worm, or None if not tracked"""
+        if self._target is None:
+            return None
+        last_frame, position, velocity = self._target
+        return position + velocity * (frame_no - last_frame)
+
+    def bbox(self, frame_no, W, H):
+        """Returns the window (left, top, right, bottom) to search in the frame, or None
+        if the whole frame has to be searched"""
+        prediction = self.predict(frame_no)
+        if prediction is None:
+            self.full_searches += 1
+            return None
+        x, y = np.round(prediction).astype(int)
+        l, t = max(x - self.window, 0), max(y - self.window, 0)
+        r, b = min(x + self.window + 1, W), min(y + self.window + 1, H)
+        if r - l <= self.window or b - t <= self.window:  # mostly outside the frame
+            self._reset()
+            self.full_searches += 1
+            return None
+        self.window_searches += 1
+        return l, t, r, b
+
+    def update(self, frame_no, candidates):
+        """Updates the prediction with the (N, 2) array of the (x, y) positions of the
+        candidates located in the frame"""
+        candidates = np.asarray(candidates, dtype=np.float64).reshape(-1, 2)
+        if self._target is not None:
+            prediction = self.predict(frame_no)
+            distances = np.hypot(*(candidates - prediction).T)
+            if len(distances) and distances.min() <= self.search_range:
+                last_frame, position, _ = self._target
+                fix = candidates[np.argmin(distances)]
+                velocity = (fix - position) / max(frame_no - last_frame, 1)
+                self._target = (frame_no, fix, velocity)
+                self._missed = 0
+            else:
+                self._missed += 1
+                if self._missed >= self.lost:
+                    self._reset()
+            return
+
+        # whole frame search, a candidate is confirmed once linked to the candidates of
+        # the previous frames for 'confirm' consecutive frames
+        streaks = np.ones(len(candidates), dtype=np.int64)
+        velocities = np.zeros_like(candidates)
+        if len(candidates) and len(self._candidates):
+            offsets = candidates[:, np.newaxis] - self._candidates[np.newaxis]
+            distances = np.hypot(offsets[..., 0], offsets[..., 1])
+            nearest = np.argmin(distances, axis=1)
+            k = np.arange(len(candidates))
+            linked = distances[k, nearest] <= self.search_range
+            streaks[linked] += self._streaks[nearest[linked]]
+            velocities[linked] = offsets[k[linked], nearest[linked]]
+        self._candidates, self._streaks = candidates, streaks
+        if len(streaks) and streaks.max() >= self.confirm:
+            k = int(np.argmax(streaks))
+            self._target = (frame_no, candidates[k], velocities[k])
+            self._missed = 0
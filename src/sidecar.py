@@ -0,0 +1,37 @@
+"""Sidecar files: arrays derived from a file, persisted next to it and reused as long as
+its size and modification time don't change"""
+import os
+import tempfile
+
+import numpy as np
+
+
+def load_sidecar(path, suffix, compute, key=()):
+    """Returns the dictionary of arrays derived from the file 'path', loaded from the
+    sidecar 'path' + 'suffix' if it is up to date, otherwise computed with 'compute()' and
+    persisted. 'key' holds the integer parameters the arrays also depend on. The sidecar
+    is written to a temporary file renamed into place, so that concurrent processes
+    never read a partial one"""
+    sidecar = path + suffix
+    stat = os.stat(path)
+    key = np.array([stat.st_size, stat.st_mtime_ns, *key], dtype=np.int64)
+    try:
+        with np.load(sidecar) as data:
+            if np.array_equal(data["key"], key):
+                return {name: data[name] for name in data.files if name != "key"}
+    except (OSError, KeyError, ValueError):
+        pass
+    arrays = compute()
+    try:
+        fd, temporary = tempfile.mkstemp(
+            prefix=os.path.basename(sidecar) + ".", dir=os.path.dirname(sidecar) or "."
+        )
+    except OSError:  # read-only location, keep the arrays in memory only
+        return arrays
+    try:
+        with os.fdopen(fd, "wb") as file:
+            np.savez(file, key=key, **arrays)
+        os.replace(temporary, sidecar)
+    except OSError:
+        os.remove(temporary)
+    return arrays
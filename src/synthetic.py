@@ -0,0 +1,127 @@
+"""Generation of synthetic worm captures with known labels, to benchmark the tracker offline"""
+import numpy as np
+import cv2
+
+
+def dish_frame(W, H, center, radius, rng):
+    """Creates a single channel frame with a textured petri dish over a dark background"""
+    frame = np.full((H, W), 30, dtype=np.uint8)
+    texture = rng.normal(150, 12, (H, W)).astype(np.float32)
+    texture = cv2.GaussianBlur(texture, (0, 0), 2)
+    I, J = np.ogrid[:H, :W]
+    dist_from_center = ((I - center[1]) / radius[1]) ** 2 + (
+        (J - center[0]) / radius[0]
+    ) ** 2
+    inside = dist_from_center <= 1
+    frame[inside] = np.clip(texture[inside], 0, 255).astype(np.uint8)
+    cv2.ellipse(frame, tuple(center), tuple(radius), 0, 0, 360, 90, 3)  # rim
+    return frame
+
+
+def worm_trajectory(
+    length,
+    center,
+    radius,
+    rng,
+    speed=1.5,
+    pause_probability=0.005,
+    resume_probability=0.01,
+):
+    """Creates a random trajectory inside the dish that alternates between moving and
+    resting stretches, returns the positions (x, y) and the headings of the worm"""
+    positions = np.zeros((length, 2))
+    headings = np.zeros(length)
+    position = np.array(center, dtype=np.float64) + rng.uniform(-0.3, 0.3, 2) * radius
+    heading = rng.uniform(0, 2 * np.pi)
+    moving = True
+    for i in range(length):
+        if moving and rng.random() < pause_probability:
+            moving = False
+        elif not moving and rng.random() < resume_probability:
+            moving = True
+        if moving:
+            heading += rng.normal(0, 0.15)
+            step = speed * np.array([np.cos(heading), np.sin(heading)])
+            relative = (position + step - center) / radius
+            if np.sum(relative**2) > 0.7**2:  # turn back towards the center
+                heading = np.arctan2(center[1] - position[1], center[0] - position[0])
+                step = speed * np.array([np.cos(heading), np.sin(heading)])
+            position = position + step
+        positions[i] = position
+        headings[i] = heading
+    return positions, headings
+
+
+def draw_worm(frame, position, heading, phase, length=30, thickness=5, intensity=40):
+    """Draws an undulating worm centered at 'position' and oriented along 'heading'"""
+    s = np.linspace(-0.5, 0.5, 12) * length
+    wave = 3.0 * np.sin(2 * np.pi * s / length + phase)
+    c, d = np.cos(heading), np.sin(heading)
+    points = np.stack(
+        [position[0] + s * c - wave * d, position[1] + s * d + wave * c], axis=1
+    )
+    cv2.polylines(
+        frame,
+        [np.round(points).astype(np.int32)],
+        False,
+        intensity,
+        thickness,
+        cv2.LINE_AA,
+    )
+    return frame
+
+
+def write_labels(path, positions):
+    """Writes the labels in the format read by labels.load_labels"""
+    with open(path, "w") as file:
+        file.write("Nr\tTID\tPID\tx[cal]\ty[cal]\tx[px]\ty[px]\tslice\n")
+        file.writelines(
+            [
+                "{}\t1\t{}\t{:.2f}\t{:.2f}\t{:.2f}\t{:.2f}\t{}\n".format(
+                    i + 1, i + 1, x, y, x, y, i
+                )
+                for i, (x, y) in enumerate(positions)
+            ]
+        )
+
+
+def generate(
+    path,
+    labels_path,
+    length,
+    W=648,
+    H=686,
+    center=(324, 343),
+    radius=(304, 323),
+    fps=50,
+    flicker=3,
+    flash_probability=0.002,
+    seed=0,
+):
+    """Writes a synthetic MJPG capture of 'length' frames with a moving worm, flicker and
+    bright flash frames, plus its true labels. Returns the positions of the worm"""
+    rng = np.random.default_rng(seed)
+    center, radius = np.array(center), np.array(radius)
+    dish = dish_frame(W, H, center, radius, rng)
+    noise = [rng.normal(0, 2, (H, W)).astype(np.int16) for _ in range(8)]
+    positions, headings = worm_trajectory(length, center, radius, rng)
+
+    out = cv2.VideoWriter(path, cv2.VideoWriter_fourcc("M", "J", "P", "G"), fps, (W, H))
+    phase = 0.0
+    for i in range(length):
+        if rng.random() < flash_probability:
+            frame = np.full((H, W), 245, dtype=np.uint8)
+        else:
+            frame = dish.copy()
+            if i > 0:
+                phase += 0.3 * np.hypot(*(positions[i] - positions[i - 1]))
+            draw_worm(frame, positions[i], headings[i], phase)
+            offset = int(np.round(flicker * np.sin(i / 7.0) + rng.normal(0, 1)))
+            frame = np.clip(frame + noise[i % len(noise)] + offset, 0, 255).astype(
+                np.uint8
+            )
+        out.write(cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR))
+    out.release()
+
+    write_labels(labels_path, positions)
+    return positions
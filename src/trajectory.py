@@ -0,0 +1,121 @@
+"""Columnar container of labels, i.e. one position per frame, with a binary format that
+can be opened memory mapped"""
+import numpy as np
+
+_MAGIC = b"WTRJ"
+_VERSION = 1
+_HEADER = np.dtype([("magic", "S4"), ("version", "<u4"), ("count", "<u8")])
+
+
+class Trajectory:
+    """Labels stored as three contiguous arrays: the frame numbers, in increasing order,
+    and the x and y coordinates of each one"""
+
+    def __init__(self, frames, x, y):
+        self.frames = np.asarray(frames)
+        self.x = np.asarray(x)
+        self.y = np.asarray(y)
+        assert len(self.frames) == len(self.x) == len(self.y)
+        # frames 0..N-1, so that a frame is found by position instead of by search
+        self._dense = len(self.frames) == 0 or (
+            self.frames[0] == 0 and self.frames[-1] == len(self.frames) - 1
+        )
+
+    @classmethod
+    def from_worm(cls, worm, length, offset=(0, 0)):
+        """Creates the labels of frames 0..'length'-1 from the worm trajectory found by
+        find_worm. Frames without the worm keep the previous label, the ones before the
+        first appearance of the worm are NaN"""
+        frames = worm["frame"].to_numpy().astype(np.int64)
+        inside = (frames >= 0) & (frames < length)
+        x = np.full(length, np.nan)
+        y = np.full(length, np.nan)
+        x[frames[inside]] = worm["x"].to_numpy()[inside] + offset[0]
+        y[frames[inside]] = worm["y"].to_numpy()[inside] + offset[1]
+        found = np.zeros(length, dtype=bool)
+        found[frames[inside]] = True
+        previous = np.maximum.accumulate(np.where(found, np.arange(length), 0))
+        return cls(np.arange(length, dtype=np.int64), x[previous], y[previous])
+
+    @classmethod
+    def from_dict(cls, labels):
+        """Creates the container from a dictionary {frame: (x, y)}"""
+        frames = np.fromiter(labels.keys(), dtype=np.int64, count=len(labels))
+        points = np.array(list(labels.values()), dtype=np.float64).reshape(-1, 2)
+        order = np.argsort(frames, kind="stable")
+        return cls(frames[order], points[order, 0], points[order, 1])
+
+    def to_dict(self):
+        """Converts to a dictionary {frame: array([x, y])}"""
+        return dict(zip(self.frames.tolist(), self.points()))
+
+    def __len__(self):
+        return len(self.frames)
+
+    def points(self):
+        """Returns the (N, 2) array of positions"""
+        return np.column_stack([self.x, self.y])
+
+    def position(self, frame):
+        """Returns the position of the given frame within the arrays, or None"""
+        if self._dense:
+            return frame if 0 <= frame < len(self.frames) else None
+        k = np.searchsorted(self.frames, frame)
+        return k if k < len(self.frames) and self.frames[k] == frame else None
+
+    def get(self, frame, default=None):
+        """Returns the label of the frame as an array [x, y], like dict.get"""
+        k = self.position(frame)
+        return default if k is None else np.array([self.x[k], self.y[k]])
+
+    def astype(self, dtype):
+        """Returns the labels with the coordinates cast to 'dtype'"""
+        return Trajectory(self.frames, self.x.astype(dtype), self.y.astype(dtype))
+
+    def save(self, path):
+        """Writes the binary format: a header followed by the frames (int64), x and y
+        (float64) columns"""
+        header = np.array([(_MAGIC, _VERSION, len(self.frames))], dtype=_HEADER)
+        with open(path, "wb") as file:
+            header.tofile(file)
+            self.frames.astype("<i8").tofile(file)
+            self.x.astype("<f8").tofile(file)
+            self.y.astype("<f8").tofile(file)
+
+    @classmethod
+    def open(cls, path, mode="r"):
+        """Opens a file written by 'save', the columns are memory mapped"""
+        header = np.fromfile(path, dtype=_HEADER, count=1)
+        if len(header) != 1 or header["magic"][0] != _MAGIC:
+            raise ValueError("{} is not a trajectory file".format(path))
+        count = int(header["count"][0])
+        if count == 0:
+            return cls(np.zeros(0, np.int64), np.zeros(0), np.zeros(0))
+        columns = [
+            np.memmap(
+                path,
+                dtype=dtype,
+                mode=mode,
+                offset=_HEADER.itemsize + k * 8 * count,
+                shape=(count,),
+            )
+            for k, dtype in enumerate(["<i8", "<f8", "<f8"])
+        ]
+        return cls(*columns)
+
+    def write_text(self, path):
+        """Writes the text format of the worm tracker output, 'frame;x;y'"""
+        np.savetxt(
+            path,
+            np.column_stack([self.frames, self.x, self.y]),
+            fmt=["%d", "%.2f", "%.2f"],
+            delimiter=";",
+            header="frame;x;y",
+            comments="",
+        )
+
+    @classmethod
+    def read_text(cls, path):
+        """Reads the text format written by 'write_text'"""
+        data = np.loadtxt(path, delimiter=";", skiprows=1, ndmin=2)
+        return cls(data[:, 0].astype(np.int64), data[:, 1], data[:, 2])
@@ -59,7 +59,7 @@ class vibe_gray:
         # fill the buffers with random values
         size = 2 * self.width + 1 if (self.width > self.height) else 2 * self.height + 1
         self.jump = np.zeros((size), np.uint32)
-        self.neighbor = np.zeros((size), np.int)
+        self.neighbor = np.zeros((size), np.int64)
         self.position = np.zeros((size), np.uint32)
         for i in range(size):
             self.jump[i] = np.random.randint(1, 2 * self.updateFactor + 1)
@@ -0,0 +1,115 @@
+"""Vectorized implementation of the ViBe background subtractor"""
+import numpy as np
+import cv2
+
+# Offsets of the 8-connected neighbours of a pixel
+_NEIGHBOURS = np.array(
+    [(-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)],
+    dtype=np.intp,
+)
+
+
+class ViBe:
+    """ViBe background subtractor for single channel frames, with the same interface as
+    the OpenCV ones. The whole frame is processed with array operations: the random
+    decisions are taken from tables precomputed at initialization, read at a random
+    offset on every frame. Those tables hold the (sorted) positions of the pixels that
+    are updated, so the update step only touches about 1/update_factor of the frame"""
+
+    def __init__(
+        self,
+        samples=20,
+        threshold=5,
+        matches=2,
+        update_factor=16,
+        init_noise=10,
+        seed=None,
+    ):
+        self.samples = samples
+        self.threshold = threshold
+        self.matches = matches
+        self.update_factor = update_factor
+        self.init_noise = init_noise
+        self._rng = np.random.default_rng(seed)
+        self._bank = None  # (samples, H, W) uint8 sample bank
+
+    def _initialize(self, image):
+        H, W = image.shape
+        noise = self._rng.integers(
+            -self.init_noise, self.init_noise + 1, (self.samples, H, W), dtype=np.int16
+        )
+        self._bank = np.clip(image + noise, 0, 255).astype(np.uint8)
+
+        # random tables, twice the size of a frame so that any offset fits a frame
+        size = 2 * H * W
+        self._self_positions = np.flatnonzero(
+            self._rng.integers(0, self.update_factor, size) == 0
+        )
+        self._self_samples = self._rng.integers(
+            0, self.samples, len(self._self_positions)
+        )
+        self._neighbour_positions = np.flatnonzero(
+            self._rng.integers(0, self.update_factor, size) == 0
+        )
+        self._neighbour_samples = self._rng.integers(
+            0, self.samples, len(self._neighbour_positions)
+        )
+        self._neighbours = _NEIGHBOURS[
+            self._rng.integers(0, len(_NEIGHBOURS), len(self._neighbour_positions))
+        ]
+
+        # buffers of the segmentation
+        self._count = np.zeros((H, W), dtype=np.uint8)
+        self._diff = np.zeros((H, W), dtype=np.uint8)
+        self._match = np.zeros((H, W), dtype=np.uint8)
+
+    def _draw(self, positions, background):
+        """Returns the slice of the table of 'positions' that falls within a frame read
+        at a random offset, and the flat indices of the background pixels in it"""
+        size = background.size
+        offset = self._rng.integers(0, size)
+        a, b = np.searchsorted(positions, [offset, offset + size])
+        pixels = positions[a:b] - offset
+        keep = background[pixels]
+        return slice(a, b), keep, pixels[keep]
+
+    def segmentation(self, image):
+        """Returns the foreground mask of the frame (255 foreground, 0 background)"""
+        count, diff, match = self._count, self._diff, self._match
+        count[:] = 0
+        for sample in self._bank:
+            cv2.absdiff(image, sample, dst=diff)
+            cv2.threshold(diff, self.threshold, 1, cv2.THRESH_BINARY_INV, dst=match)
+            cv2.add(count, match, dst=count)
+        return np.where(count < self.matches, 255, 0).astype(np.uint8)
+
+    def update(self, image, segmentation_map):
+        """Updates the model with the background pixels of the frame: each of them
+        replaces, with probability 1/update_factor, a random sample of its own model
+        and, independently, a random sample of the model of a random neighbour"""
+        H, W = image.shape
+        bank = self._bank.reshape(self.samples, H * W)
+        image = image.ravel()
+        background = segmentation_map.ravel() == 0
+
+        table, keep, pixels = self._draw(self._self_positions, background)
+        bank[self._self_samples[table][keep], pixels] = image[pixels]
+
+        table, keep, pixels = self._draw(self._neighbour_positions, background)
+        neighbours = self._neighbours[table][keep]
+        ny = np.clip(pixels // W + neighbours[:, 0], 0, H - 1)
+        nx = np.clip(pixels % W + neighbours[:, 1], 0, W - 1)
+        bank[self._neighbour_samples[table][keep], ny * W + nx] = image[pixels]
+
+    def apply(self, image, fgmask=None):
+        """Segments the frame and updates the model, returns the foreground mask, written
+        to 'fgmask' if given"""
+        image = np.ascontiguousarray(image)
+        if self._bank is None or self._bank.shape[1:] != image.shape:
+            self._initialize(image)
+        segmentation_map = self.segmentation(image)
+        self.update(image, segmentation_map)
+        if fgmask is not None:
+            np.copyto(fgmask, segmentation_map)
+            return fgmask
+        return segmentation_map
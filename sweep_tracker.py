@@ -0,0 +1,319 @@
+"""Parameter sweep script: tracks the worm with every combination of a grid (or a random
+sample of it) of 'trackpy.locate', 'trackpy.link' and 'find_worm' parameters, and ranks
+them by their evaluation. Each stage is computed once per distinct configuration of the
+stages it depends on: the foreground once, the locations once per 'trackpy.locate'
+configuration and the links once per 'trackpy.locate' and 'trackpy.link' configuration"""
+import sys
+import csv
+import copy
+import json
+import time
+import argparse
+import warnings
+import multiprocessing
+
+warnings.filterwarnings("ignore")
+
+import yaml
+import numpy as np
+import pandas as pd
+import cv2
+import trackpy as tp
+
+from worm_tracker import (
+    load_capture,
+    frame_quality,
+    skip_bad_frames,
+    petri_roi,
+    roi_offset,
+    preprocess_capture,
+    background_subtraction,
+    locate_options,
+    trackpy_link,
+    find_worm,
+    compute_labels,
+)
+from src.labels import load_true_labels
+from src.evaluation import (
+    evaluate_runs,
+    distance,
+    euclidean_distance,
+    custom_accuracy,
+)
+
+SECTIONS = ["trackpy.locate", "trackpy.link", "find_worm"]
+METRICS = ["count", "accuracy", "distance", "euclidean"]
+
+
+def parse_args(args):
+    """Parse arguments"""
+    parser = argparse.ArgumentParser(description="Worm tracker parameter sweep")
+    parser.add_argument(
+        "-I", "--input", help="path of the input capture", required=True
+    )
+    parser.add_argument("-L", "--labels", help="path of the true labels", required=True)
+    parser.add_argument(
+        "-G",
+        "--grid",
+        help="path of the grid, a yaml file mapping parameters, e.g. "
+        "'trackpy.locate.minmass', to lists of values",
+        required=True,
+    )
+    parser.add_argument(
+        "-C",
+        "--configuration",
+        help="path of the base configuration",
+        default="default_configuration.yaml",
+    )
+    parser.add_argument(
+        "-N",
+        "--samples",
+        help="number of combinations sampled at random, instead of the whole grid",
+        type=int,
+        default=None,
+    )
+    parser.add_argument(
+        "-R", "--seed", help="seed of the random sample", type=int, default=0
+    )
+    parser.add_argument(
+        "-J",
+        "--jobs",
+        help="number of processes",
+        type=int,
+        default=multiprocessing.cpu_count(),
+    )
+    parser.add_argument(
+        "-O", "--output", help="path of the ranking", default="sweep.csv"
+    )
+    return parser.parse_args(args)
+
+
+def load_grid(path):
+    """Loads the grid {parameter: [values]}, the parameters being dotted paths within the
+    sections that can be swept"""
+    with open(path, "r") as file:
+        grid = yaml.safe_load(file)
+    for parameter, values in grid.items():
+        section = parameter.rsplit(".", 1)[0]
+        assert section in SECTIONS, "{} is not in {}".format(parameter, SECTIONS)
+        assert isinstance(values, list) and values, "{} has no values".format(parameter)
+    return grid
+
+
+def combinations(grid, samples=None, seed=0):
+    """Returns the combinations {parameter: value} of the grid, all of them or a random
+    sample of 'samples' different ones"""
+    parameters = list(grid)
+    sizes = [len(grid[parameter]) for parameter in parameters]
+    total = int(np.prod(sizes))
+    if samples is None or samples >= total:
+        indices = range(total)
+    else:
+        rng = np.random.default_rng(seed)
+        indices = sorted(rng.choice(total, size=samples, replace=False))
+    return [
+        {
+            parameter: grid[parameter][k]
+            for parameter, k in zip(parameters, np.unravel_index(index, sizes))
+        }
+        for index in indices
+    ]
+
+
+def _section(configuration, section):
+    for key in section.split("."):
+        configuration = configuration[key]
+    return configuration
+
+
+def apply_combination(configuration, combination):
+    """Returns a copy of the configuration with the values of the combination"""
+    configuration = copy.deepcopy(configuration)
+    for parameter, value in combination.items():
+        section, key = parameter.rsplit(".", 1)
+        _section(configuration, section)[key] = value
+    return configuration
+
+
+def _key(configuration, sections):
+    return json.dumps([_section(configuration, s) for s in sections], sort_keys=True)
+
+
+def foreground_masks(path, configuration, roi, bad):
+    """Yields the index and the foreground mask of every frame dark enough to be located
+    (see trackpy_locate_iter), computed in a single pass over the capture"""
+    capture = load_capture(path, configuration)
+    if bad is not None:
+        capture = skip_bad_frames(capture, bad)
+    capture = preprocess_capture(capture, configuration["preprocessing"], roi)
+    capture = background_subtraction(capture, configuration["background_subtraction"])
+    for i, frame in capture.frames():
+        mask = frame[:, :, 0]
+        if cv2.mean(mask)[0] <= 30:
+            yield i, np.ascontiguousarray(mask)  # a copy, the frames may be reused
+
+
+def locate_many(task):
+    """Locates the candidates of the foreground mask of a frame, the task (index, mask,
+    configurations), with each one of the 'trackpy.locate' configurations. Returns the
+    locations per configuration, None where there is no candidate"""
+    i, mask, locate_configurations = task
+    locations = []
+    for locate in locate_configurations:
+        tmp_locations = tp.locate(mask, locate["diameter"], **locate_options(locate))
+        if tmp_locations.empty:
+            locations.append(None)
+            continue
+        tmp_locations["frame"] = i
+        locations.append(tmp_locations)
+    return locations
+
+
+def link_and_evaluate(locations, configurations, length, offset, true_labels):
+    """Links the locations once for the 'trackpy.link' configuration shared by every
+    configuration, then finds the worm with each of them and evaluates all the labels
+    at once. Returns the (count, distance, euclidean, accuracy) of each configuration"""
+    if locations.empty:
+        return [(0, np.nan, np.nan, np.nan)] * len(configurations)
+    links = trackpy_link(locations, configurations[0]["trackpy"]["link"])
+    runs = []
+    for configuration in configurations:
+        worm = find_worm(links, configuration["find_worm"])
+        runs.append(compute_labels(worm, length, offset))
+    # the radixes aren't swept, so a single accuracy metric serves every run
+    labels_configuration = configurations[0]["labels"]
+    metrics = evaluate_runs(
+        true_labels,
+        runs,
+        {
+            "distance": distance(),
+            "euclidean": euclidean_distance(),
+            "accuracy": custom_accuracy(
+                labels_configuration["small_radix"], labels_configuration["big_radix"]
+            ),
+        },
+    )
+    return [
+        (count, mean_distance, euclidean[1], accuracy[1])
+        for (count, mean_distance), euclidean, accuracy in zip(
+            metrics["distance"], metrics["euclidean"], metrics["accuracy"]
+        )
+    ]
+
+
+def sweep(path, labels_path, configuration, combos, jobs):
+    """Evaluates every combination, returns a row per combination"""
+    capture = load_capture(path, configuration)
+    length = capture.length()
+    roi = petri_roi(capture, configuration["preprocessing"])
+    offset = roi_offset(capture, roi, configuration["preprocessing"])
+    bad = frame_quality(path, configuration)
+    true_labels = load_true_labels(labels_path)
+    configurations = [apply_combination(configuration, combo) for combo in combos]
+
+    # locations, once per distinct 'trackpy.locate' configuration, with the foreground
+    # computed once, by this process, and located by the pool
+    locate_keys = list(
+        dict.fromkeys(_key(c, ["trackpy.locate"]) for c in configurations)
+    )
+    locate_configurations = [json.loads(key)[0] for key in locate_keys]
+    print(
+        "> Locating {} frames with {} configurations...".format(
+            length, len(locate_configurations)
+        )
+    )
+    masks = foreground_masks(path, configuration, roi, bad)
+    with multiprocessing.Pool(jobs) as pool:
+        results = list(
+            pool.imap(
+                locate_many,
+                ((i, mask, locate_configurations) for i, mask in masks),
+            )
+        )
+    locations = {}
+    for k, key in enumerate(locate_keys):
+        locations_list = [frame[k] for frame in results if frame[k] is not None]
+        locations[key] = (
+            pd.concat(locations_list, ignore_index=True)
+            if locations_list
+            else pd.DataFrame()
+        )
+
+    # links, once per distinct 'trackpy.locate' and 'trackpy.link' configuration, and
+    # every 'find_worm' variant of them
+    groups = {}
+    for k, c in enumerate(configurations):
+        groups.setdefault(_key(c, ["trackpy.locate", "trackpy.link"]), []).append(k)
+    print("> Linking {} configurations...".format(len(groups)))
+    tasks = [
+        (
+            locations[_key(configurations[ks[0]], ["trackpy.locate"])],
+            [configurations[k] for k in ks],
+            length,
+            offset,
+            true_labels,
+        )
+        for ks in groups.values()
+    ]
+    with multiprocessing.Pool(jobs) as pool:
+        results = pool.starmap(link_and_evaluate, tasks)
+
+    rows = [None] * len(configurations)
+    for ks, group_results in zip(groups.values(), results):
+        for k, (count, mean_distance, mean_euclidean, accuracy) in zip(
+            ks, group_results
+        ):
+            rows[k] = dict(
+                combos[k],
+                count=count,
+                accuracy=accuracy,
+                distance=mean_distance,
+                euclidean=mean_euclidean,
+            )
+    # best accuracy first, then smallest distance (NaN last)
+    rows.sort(
+        key=lambda row: (
+            -np.nan_to_num(row["accuracy"], nan=-np.inf),
+            np.nan_to_num(row["distance"], nan=np.inf),
+        )
+    )
+    return rows
+
+
+def main():
+    """Main function"""
+    args = parse_args(sys.argv[1:])
+    assert args.jobs >= 1
+    with open(args.configuration, "r") as file:
+        configuration = yaml.safe_load(file)
+    grid = load_grid(args.grid)
+    combos = combinations(grid, args.samples, args.seed)
+    print("Worm tracker sweep - {} combinations".format(len(combos)))
+
+    start_time = time.perf_counter()
+    rows = sweep(args.input, args.labels, configuration, combos, args.jobs)
+    with open(args.output, "w", newline="") as file:
+        writer = csv.DictWriter(file, fieldnames=["rank"] + list(grid) + METRICS)
+        writer.writeheader()
+        writer.writerows(
+            [dict(row, rank=rank) for rank, row in enumerate(rows, start=1)]
+        )
+    print(
+        "Finished in {:.1f} s. Best combinations:".format(
+            time.perf_counter() - start_time
+        )
+    )
+    for rank, row in enumerate(rows[:5], start=1):
+        print(
+            "    {}. custom accuracy [{}], mean manhattan distance [{}]: {}".format(
+                rank,
+                row["accuracy"],
+                row["distance"],
+                ", ".join("{} {}".format(p, row[p]) for p in grid),
+            )
+        )
+    print("+ Ranking written to {}.".format(args.output))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""Counts the frame sized allocations made by the preprocessing and background subtraction
+stages, per frame, with and without the grayscale mode. Run from the root of the
+repository: python3 tests/benchmarks/allocation_benchmark.py -I capture.avi"""
+import sys
+import copy
+import argparse
+import tracemalloc
+
+sys.path.append(".")
+
+import yaml
+
+from worm_tracker import (
+    load_capture,
+    preprocess_capture,
+    petri_roi,
+    background_subtraction,
+)
+
+
+def parse_args(args):
+    """Parse arguments"""
+    parser = argparse.ArgumentParser(description="Allocations of the preprocessing")
+    parser.add_argument(
+        "-I", "--input", help="path of the input capture", required=True
+    )
+    parser.add_argument(
+        "-C",
+        "--configuration",
+        help="path of the configuration",
+        default="default_configuration.yaml",
+    )
+    parser.add_argument(
+        "-N", "--limit", help="number of frames to process", type=int, default=300
+    )
+    parser.add_argument(
+        "--warm-up",
+        help="number of frames during which the buffers are allocated",
+        type=int,
+        default=10,
+    )
+    return parser.parse_args(args)
+
+
+def count_allocations(path, configuration, limit, warm_up):
+    """Returns the number of frames (after 'warm_up') whose processing allocated at least
+    one buffer of half the size of a processed frame, and the mean of the memory peak
+    above the memory in use before each frame. Allocations of numpy arrays, including
+    those created by OpenCV, are traced by tracemalloc"""
+    capture = load_capture(path, configuration, stop=limit)
+    roi = petri_roi(capture, configuration["preprocessing"])
+    capture = preprocess_capture(capture, configuration["preprocessing"], roi)
+    capture = background_subtraction(capture, configuration["background_subtraction"])
+    frame_nbytes = capture.W() * capture.H() * capture.C()
+
+    tracemalloc.start()
+    frames = capture.frames()
+    allocating, peaks, k = 0, [], 0
+    while True:
+        current, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        try:
+            next(frames)
+        except StopIteration:
+            break
+        _, peak = tracemalloc.get_traced_memory()
+        if k >= warm_up:
+            peaks.append(peak - current)
+            allocating += peak - current >= frame_nbytes // 2
+        k += 1
+    tracemalloc.stop()
+    return allocating, len(peaks), sum(peaks) / max(len(peaks), 1)
+
+
+def main():
+    """Main function"""
+    args = parse_args(sys.argv[1:])
+    with open(args.configuration, "r") as file:
+        configuration = yaml.safe_load(file)
+
+    for grayscale in [False, True]:
+        mode_configuration = copy.deepcopy(configuration)
+        mode_configuration["preprocessing"]["grayscale"] = grayscale
+        allocating, frames, peak = count_allocations(
+            args.input, mode_configuration, args.limit, args.warm_up
+        )
+        print(
+            "grayscale {}: {}/{} frames with frame sized allocations, mean peak {:.0f} bytes/frame".format(
+                grayscale, allocating, frames, peak
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
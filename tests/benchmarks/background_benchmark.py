@@ -0,0 +1,123 @@
+"""Comparison of the background models: throughput and, if the true labels are given,
+the resulting tracking accuracy. Run from the root of the repository:
+python3 tests/benchmarks/background_benchmark.py -I capture.avi [-L true_labels.txt]"""
+import sys
+import time
+import copy
+import argparse
+
+sys.path.append(".")
+
+import yaml
+
+from src.capture import LazyCapture
+from src.background import create_background_model
+from src.labels import load_true_labels
+from src.evaluation import evaluate, distance, custom_accuracy
+from worm_tracker import (
+    preprocess_capture,
+    petri_roi,
+    roi_offset,
+    background_subtraction,
+    trackpy_locate,
+    trackpy_link,
+    find_worm,
+    compute_labels,
+)
+
+METHODS = ["mog2", "knn", "vibe", "median", "average"]
+
+
+def parse_args(args):
+    """Parse arguments"""
+    parser = argparse.ArgumentParser(description="Background models comparison")
+    parser.add_argument(
+        "-I", "--input", help="path of the input capture", required=True
+    )
+    parser.add_argument(
+        "-C",
+        "--configuration",
+        help="path of the configuration",
+        default="default_configuration.yaml",
+    )
+    parser.add_argument(
+        "-L", "--labels", help="path of the true labels", required=False
+    )
+    parser.add_argument(
+        "-M",
+        "--methods",
+        help="background models to compare",
+        nargs="+",
+        default=METHODS,
+    )
+    parser.add_argument(
+        "-N", "--limit", help="number of frames to process", type=int, default=None
+    )
+    return parser.parse_args(args)
+
+
+def throughput(frames, configuration):
+    """Returns the frames per second of the background model alone"""
+    model = create_background_model(configuration)
+    start = time.perf_counter()
+    for frame in frames:
+        model.apply(frame)
+    return len(frames) / (time.perf_counter() - start)
+
+
+def accuracy(path, configuration, true_labels, limit=None):
+    """Tracks the worm with the given configuration, returns the evaluation"""
+    capture = LazyCapture.load(path, stop=limit)
+    roi = petri_roi(capture, configuration["preprocessing"])
+    offset = roi_offset(capture, roi, configuration["preprocessing"])
+    capture = preprocess_capture(capture, configuration["preprocessing"], roi)
+    capture = background_subtraction(capture, configuration["background_subtraction"])
+    locations = trackpy_locate(capture, configuration["trackpy"]["locate"])
+    links = trackpy_link(locations, configuration["trackpy"]["link"])
+    worm = find_worm(links, configuration["find_worm"])
+    labels = compute_labels(worm, capture.length(), offset)
+    eval_distance = evaluate(true_labels, labels, distance())
+    eval_accuracy = evaluate(
+        true_labels,
+        labels,
+        custom_accuracy(
+            configuration["labels"]["small_radix"],
+            configuration["labels"]["big_radix"],
+        ),
+    )
+    return eval_distance[1], eval_accuracy[1]
+
+
+def main():
+    """Main function"""
+    args = parse_args(sys.argv[1:])
+    with open(args.configuration, "r") as file:
+        configuration = yaml.safe_load(file)
+    true_labels = load_true_labels(args.labels) if args.labels is not None else None
+
+    capture = LazyCapture.load(args.input, stop=args.limit)
+    roi = petri_roi(capture, configuration["preprocessing"])
+    capture = preprocess_capture(capture, configuration["preprocessing"], roi)
+    # copied, as in grayscale mode every frame is computed in the same buffer
+    frames = [frame[:, :, 0].copy() for _, frame in capture.frames()]
+    print("{} frames of {}x{}".format(len(frames), capture.W(), capture.H()))
+
+    for method in args.methods:
+        method_configuration = copy.deepcopy(configuration)
+        method_configuration["background_subtraction"]["method"] = method
+        fps = throughput(frames, method_configuration["background_subtraction"])
+        if true_labels is None:
+            print("{}: {:.1f} frames/s".format(method, fps))
+        else:
+            mean_distance, mean_accuracy = accuracy(
+                args.input, method_configuration, true_labels, args.limit
+            )
+            print(
+                "{}: {:.1f} frames/s, mean manhattan distance [{}], custom accuracy [{}]".format(
+                    method, fps, mean_distance, mean_accuracy
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""Benchmark of the forward and reverse decoding throughput of LazyCapture.
+Run from the root of the repository: python3 tests/benchmarks/capture_benchmark.py -I capture.avi"""
+import sys
+import time
+import argparse
+
+sys.path.append(".")
+
+from src.capture import LazyCapture
+
+
+def parse_args(args):
+    """Parse arguments"""
+    parser = argparse.ArgumentParser(description="LazyCapture decoding benchmark")
+    parser.add_argument(
+        "-I", "--input", help="path of the input capture", required=True
+    )
+    parser.add_argument(
+        "-N", "--limit", help="number of frames to decode", type=int, default=None
+    )
+    parser.add_argument(
+        "-B",
+        "--buffers",
+        help="reverse buffer sizes to try, in MB",
+        type=int,
+        nargs="+",
+        default=[16, 64, 256],
+    )
+    return parser.parse_args(args)
+
+
+def throughput(capture, reverse=False):
+    """Returns the number of frames decoded and the frames per second"""
+    start = time.perf_counter()
+    n = 0
+    for _ in capture.frames(reverse=reverse):
+        n += 1
+    return n, n / (time.perf_counter() - start)
+
+
+def main():
+    """Main function"""
+    args = parse_args(sys.argv[1:])
+
+    n, fps = throughput(LazyCapture.load(args.input, stop=args.limit))
+    print("forward: {} frames, {:.1f} frames/s".format(n, fps))
+    for mb in args.buffers:
+        capture = LazyCapture.load(
+            args.input, stop=args.limit, reverse_buffer=mb * 2**20
+        )
+        n, fps = throughput(capture, reverse=True)
+        print("reverse ({} MB buffer): {} frames, {:.1f} frames/s".format(mb, n, fps))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+"""End-to-end benchmark of the worm tracker on synthetic captures of several lengths:
+wall time and frames per second of every stage, plus the peak memory of the process.
+Run from the root of the repository: python3 tests/benchmarks/pipeline_benchmark.py"""
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import tempfile
+import multiprocessing
+
+sys.path.append(".")
+
+import yaml
+
+from src.capture import LazyCapture
+from src.synthetic import generate
+from src.labels import load_true_labels
+from src.evaluation import evaluate, custom_accuracy
+from worm_tracker import (
+    preprocess_capture,
+    petri_roi,
+    roi_offset,
+    background_subtraction,
+    trackpy_locate,
+    trackpy_link,
+    find_worm,
+    compute_labels,
+)
+
+
+def parse_args(args):
+    """Parse arguments"""
+    parser = argparse.ArgumentParser(description="Worm tracker benchmark")
+    parser.add_argument(
+        "-C",
+        "--configuration",
+        help="path of the configuration",
+        default="default_configuration.yaml",
+    )
+    parser.add_argument(
+        "-N",
+        "--lengths",
+        help="lengths of the synthetic captures",
+        type=int,
+        nargs="+",
+        default=[500, 1000, 2000],
+    )
+    parser.add_argument(
+        "-D", "--directory", help="directory for the synthetic captures", default=None
+    )
+    parser.add_argument(
+        "-O", "--output", help="path of the json report", required=False
+    )
+    return parser.parse_args(args)
+
+
+def _consume(capture):
+    for _ in capture.frames():
+        pass
+
+
+def _timed(timings, name, func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    timings[name] = time.perf_counter() - start
+    return result
+
+
+def benchmark(path, labels_path, configuration):
+    """Runs every stage of the tracker, returns the wall time of each one. As the
+    capture stages are lazy, they are timed cumulatively and then subtracted"""
+    timings = {}
+    capture = LazyCapture.load(path)
+    roi = petri_roi(capture, configuration["preprocessing"])
+    offset = roi_offset(capture, roi, configuration["preprocessing"])
+
+    _timed(timings, "decode", _consume, capture)
+    capture = preprocess_capture(capture, configuration["preprocessing"], roi)
+    _timed(timings, "preprocess", _consume, capture)
+    capture = background_subtraction(capture, configuration["background_subtraction"])
+    _timed(timings, "background_subtraction", _consume, capture)
+    locations = _timed(
+        timings, "locate", trackpy_locate, capture, configuration["trackpy"]["locate"]
+    )
+    for later, earlier in [
+        ("locate", "background_subtraction"),
+        ("background_subtraction", "preprocess"),
+        ("preprocess", "decode"),
+    ]:
+        timings[later] = max(timings[later] - timings[earlier], 0.0)
+
+    links = _timed(
+        timings, "link", trackpy_link, locations, configuration["trackpy"]["link"]
+    )
+    worm = _timed(timings, "find_worm", find_worm, links, configuration["find_worm"])
+    labels = _timed(
+        timings, "compute_labels", compute_labels, worm, capture.length(), offset
+    )
+    true_labels = load_true_labels(labels_path)
+    _, accuracy = _timed(
+        timings,
+        "evaluate",
+        evaluate,
+        true_labels,
+        labels,
+        custom_accuracy(
+            configuration["labels"]["small_radix"],
+            configuration["labels"]["big_radix"],
+        ),
+    )
+    return {
+        "frames": capture.length(),
+        "stages": timings,
+        "accuracy": accuracy,
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def main():
+    """Main function"""
+    args = parse_args(sys.argv[1:])
+    with open(args.configuration, "r") as file:
+        configuration = yaml.safe_load(file)
+    petri = configuration["preprocessing"]["remove_outside_petri"]
+
+    directory = args.directory or tempfile.mkdtemp(prefix="worm_benchmark_")
+    # every length runs in a fresh process, so that the peak memory is its own
+    context = multiprocessing.get_context("spawn")
+    report = []
+    for length in args.lengths:
+        path = os.path.join(directory, "synthetic_{}.avi".format(length))
+        labels_path = os.path.join(directory, "synthetic_{}.txt".format(length))
+        if not os.path.exists(path):
+            generate(
+                path,
+                labels_path,
+                length,
+                center=petri["center"],
+                radius=petri["radius"],
+            )
+        with context.Pool(1) as pool:
+            result = pool.apply(benchmark, (path, labels_path, configuration))
+        report.append(result)
+
+        total = sum(result["stages"].values())
+        print(
+            "{} frames: {:.2f} s, {:.1f} frames/s, peak RSS {:.0f} MB, accuracy {:.3f}".format(
+                result["frames"],
+                total,
+                result["frames"] / total,
+                result["peak_rss_mb"],
+                result["accuracy"],
+            )
+        )
+        for stage, seconds in result["stages"].items():
+            print(
+                "    {:<24}{:>8.2f} s{:>10.1f} frames/s".format(
+                    stage, seconds, result["frames"] / seconds if seconds else 0.0
+                )
+            )
+
+    if args.output is not None:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
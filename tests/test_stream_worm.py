@@ -0,0 +1,37 @@
+"""Tests of the online determination of the worm. Run from the root of the repository:
+python3 -m pytest tests"""
+import io
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import pandas as pd
+
+from worm_tracker import stream_worm, find_worm, compute_labels
+from src.trajectory import Trajectory
+
+
+def _links(frames):
+    """Links of a single particle at x = y = frame in each one of the frames"""
+    return [
+        pd.DataFrame({"frame": [f], "particle": [0], "x": [float(f)], "y": [float(f)]})
+        for f in frames
+    ]
+
+
+def test_gap_keeps_previous_label():
+    """Frames without candidates between two decided frames keep the previous label, as
+    in compute_labels"""
+    links, length = _links([0, 1, 2, 3, 4, 5, 9, 10, 11, 12]), 14
+    file = io.StringIO("frame;x;y\n")
+    file.seek(0, io.SEEK_END)
+    stream_worm(iter(links), {"min_points": 2}, 50, length, file)
+    file.seek(0)
+    streamed = Trajectory.read_text(file)
+    expected = compute_labels(find_worm(pd.concat(links), {"min_points": 2}), length)
+    np.testing.assert_array_equal(streamed.frames, expected.frames)
+    np.testing.assert_allclose(streamed.x, expected.x)
+    np.testing.assert_allclose(streamed.y, expected.y)
+    np.testing.assert_allclose(streamed.x[6:9], 5.0)
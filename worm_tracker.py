@@ -2,6 +2,9 @@
 import sys
 import argparse
 import warnings
+import time
+import multiprocessing
+from collections import deque
 
 warnings.filterwarnings("ignore")
 
@@ -13,8 +16,21 @@ import cv2
 import trackpy as tp
 
 from src.capture import LazyCapture
-from src.frames import select_channel, remove_outside_petri, annotate
-from src.labels import load_labels, map_labels, larr2i
+from src.background import create_background_model
+from src.profiling import Profiler, measure
+from src.quality import load_quality_index, bad_frames
+from src.frames import (
+    select_channel,
+    extract_channel,
+    remove_outside_petri,
+    petri_bbox,
+    detect_petri,
+    annotate,
+)
+from src.trajectory import Trajectory
+from src.cache import StageCache, fingerprint, stage_key
+from src.search import PredictiveSearch
+from src.labels import load_true_labels, load_output_labels
 from src.evaluation import evaluate, distance, custom_accuracy
 
 
@@ -39,6 +55,28 @@ def parse_args(args):
     parser.add_argument(
         "-L", "--labels", help="path of the input labels", required=False
     )
+    parser.add_argument(
+        "-W",
+        "--workers",
+        help="number of processes among which the capture is split",
+        type=int,
+        default=1,
+        required=False,
+    )
+    parser.add_argument(
+        "-P", "--profile", help="path of the profiling report", required=False
+    )
+    parser.add_argument(
+        "-S",
+        "--stream",
+        help="track online, writing the output labels as the frames are processed",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--no-cache",
+        help="compute every stage, neither reading nor writing the stage cache",
+        action="store_true",
+    )
 
     results = parser.parse_args(args)
     return (
@@ -47,45 +85,187 @@ def parse_args(args):
         results.output,
         results.annotation,
         results.labels,
+        results.workers,
+        results.profile,
+        results.stream,
+        results.no_cache,
+    )
+
+
+def load_capture(path, configuration, start=0, stop=None):
+    """Loads the input capture, decoding it ahead on a background thread if configured"""
+    configuration = configuration.get("capture", {})
+    return LazyCapture.load(
+        path,
+        start=start,
+        stop=stop,
+        prefetch=configuration.get("prefetch", 0),
+        borrow=configuration.get("borrow", False),
     )
 
 
-def preprocess_capture(capture, configuration):
-    """Preprocess the input capture"""
+def open_cache(configuration):
+    """Opens the stage cache specified by the 'cache' configuration, disabled if not used"""
+    configuration = configuration.get("cache", {})
+    if not configuration.get("apply", False):
+        return StageCache()
+    return StageCache(configuration["directory"], configuration["max_size"] * 2**20)
+
+
+# version of the outputs of the stages, to be increased when a change of the code changes
+# them, so that the outputs cached by the previous code aren't reused
+CACHE_VERSION = 2
+
+
+def stage_keys(path, configuration, workers=1):
+    """Returns the cache key of each stage of the tracking of the capture at 'path', built
+    from the content of the capture and the configuration of that stage and the previous
+    ones"""
+    search = predictive_search(configuration)
+    foreground = stage_key(
+        fingerprint(path),
+        CACHE_VERSION,
+        configuration.get("quality", {}),
+        configuration["preprocessing"],
+        configuration["background_subtraction"],
+        search is None,  # whether the morphology is applied
+    )
+    # the chunks of the parallel location start with a warmed up background model
+    locations = stage_key(
+        foreground, configuration["trackpy"]["locate"], search, workers
+    )
+    links = stage_key(locations, configuration["trackpy"]["link"])
+    labels = stage_key(links, configuration["find_worm"])
+    return {
+        "foreground": foreground,
+        "locations": locations,
+        "links": links,
+        "labels": labels,
+    }
+
+
+def frame_quality(path, configuration):
+    """Returns which frames to skip according to the quality index of the capture, or
+    None if the index isn't used"""
+    configuration = configuration.get("quality", {})
+    if not configuration.get("apply", False):
+        return None
+    index = load_quality_index(path, configuration["scale"])
+    return bad_frames(index, configuration)
+
+
+def skip_bad_frames(capture, bad, start=0):
+    """Drops the frames flagged by the quality index before any processing, so that the
+    background model isn't updated with them. 'start' is the index of the first frame"""
+
+    def good_frame(i, frame):
+        return i >= len(bad) or not bad[i]
+
+    skipped = int(np.count_nonzero(bad[start : start + capture.length()]))
+    capture.filter(good_frame, name="quality", length=capture.length() - skipped)
+    return capture
+
+
+def petri_roi(capture, configuration):
+    """Determines the petri dish, either from the configuration or by detecting it on the
+    median of a sample of frames. Returns its center and radius, or None if not used"""
+    configuration = configuration["remove_outside_petri"]
+    if not configuration["apply"]:
+        return None
+    if configuration.get("detect", False):
+        indices = np.linspace(0, capture.length() - 1, configuration.get("samples", 25))
+        sample = np.stack(
+            [capture.frame(int(i))[:, :, 1] for i in np.unique(indices.astype(int))]
+        )
+        roi = detect_petri(np.median(sample, axis=0).astype(np.uint8))
+        if roi is not None:
+            return roi
+        print("# Petri dish not detected, using the configured one")
+    return configuration["center"], configuration["radius"]
+
+
+def roi_offset(capture, roi, configuration):
+    """Returns the position of the preprocessed frames within the original frames"""
+    if roi is None or not configuration["remove_outside_petri"].get("crop", False):
+        return 0, 0
+    l, t, _, _ = petri_bbox(roi[0], roi[1], capture.W(), capture.H())
+    return l, t
+
+
+def preprocess_capture(capture, configuration, roi=None):
+    """Preprocess the input capture. In 'grayscale' mode, the channel is extracted (and
+    cropped) into a contiguous buffer reused for every frame, only valid until the next
+    one is requested, which the following stages process in place"""
+    if configuration.get("grayscale", False):
+        bbox, W, H = None, capture.W(), capture.H()
+        center = roi[0] if roi is not None else None
+        if roi is not None and configuration["remove_outside_petri"].get("crop", False):
+            bbox = petri_bbox(roi[0], roi[1], capture.W(), capture.H())
+            W, H = bbox[2] - bbox[0], bbox[3] - bbox[1]
+            center = (roi[0][0] - bbox[0], roi[0][1] - bbox[1])
+        capture.apply(extract_channel(1, bbox, reuse=True), shape=(W, H, 1))
+        if roi is not None:
+            capture.apply(remove_outside_petri(center, roi[1]))
+        return capture
+
     capture.apply(select_channel(1), shape=(capture.W(), capture.H(), 1))
-    if configuration["remove_outside_petri"]["apply"]:
+    if roi is not None:
+        shape = None
+        if configuration["remove_outside_petri"].get("crop", False):
+            l, t, r, b = petri_bbox(roi[0], roi[1], capture.W(), capture.H())
+            shape = (r - l, b - t, 1)
         capture.apply(
-            remove_outside_petri(
-                configuration["remove_outside_petri"]["center"],
-                configuration["remove_outside_petri"]["radius"],
-            )
+            remove_outside_petri(roi[0], roi[1], hard=shape is not None), shape=shape
         )
     return capture
 
 
-def background_subtraction(capture, configuration):
-    """Apply background subtraction to every frame"""
+_KERNEL = np.ones((11, 11), np.uint8)
+
+
+def foreground_morphology(mask):
+    """Closes and smooths the foreground mask, in place"""
+    cv2.morphologyEx(mask, cv2.MORPH_CLOSE, _KERNEL, dst=mask)
+    cv2.blur(mask, (5, 5), dst=mask)
+    return mask
+
+
+def background_subtraction(capture, configuration, morphology=True):
+    """Apply background subtraction to every frame, followed by the morphology unless
+    'morphology' is False (see trackpy_locate_iter)"""
 
     def apply_background_subtraction(i, frame, acc):
+        if frame.flags.c_contiguous:  # single channel, the mask overwrites the frame
+            acc.apply(frame[:, :, 0], fgmask=frame[:, :, 0])
+            return frame, acc
         frame = acc.apply(frame[:, :, 0])
-        frame = cv2.morphologyEx(frame, cv2.MORPH_CLOSE, np.ones((11,11), np.uint8))
-        frame = cv2.blur(frame, (5, 5))
         return frame[:, :, np.newaxis], acc
 
-    background_subtractor = cv2.createBackgroundSubtractorMOG2(
-        history=configuration["history"],
-        varThreshold=configuration["varTreshold"],
-        detectShadows=False,
-    )
-    background_subtractor.setNMixtures(configuration["NMixtures"])
+    def apply_morphology(i, frame):
+        foreground_morphology(frame[:, :, 0])
+        return frame
+
+    background_subtractor = create_background_model(configuration)
 
-    capture.apply(apply_background_subtraction, acc=background_subtractor)
+    capture.apply(
+        apply_background_subtraction,
+        acc=background_subtractor,
+        name="background_subtraction",
+    )
+    if morphology:
+        capture.apply(apply_morphology, name="morphology")
     return capture
 
 
-def trackpy_locate(capture, configuration):
-    """Locate worm candidates in every frame"""
-    locate_options = {
+def predictive_search(configuration):
+    """Returns the 'predictive_search' configuration, or None if not used"""
+    configuration = configuration.get("predictive_search", {})
+    return configuration if configuration.get("apply", False) else None
+
+
+def locate_options(configuration):
+    """Returns the options of tp.locate for the 'trackpy.locate' configuration"""
+    return {
         "minmass": configuration["minmass"],
         "maxsize": None,
         "separation": configuration["separation"],
@@ -99,23 +279,128 @@ def trackpy_locate(capture, configuration):
         "max_iterations": 10,
         "characterize": False,
     }
+
+
+def trackpy_locate_iter(
+    capture, configuration, first_frame=0, profiler=None, search=None
+):
+    """Locate worm candidates in every frame whose index is at least 'first_frame', yields
+    the candidates of each frame as soon as they are located"""
+    locate = tp.locate if profiler is None else profiler.wrap(tp.locate, "locate")
+    options = locate_options(configuration)
+    predictor, morphology = None, None
+    if search is not None:
+        predictor = PredictiveSearch(
+            search["window"], search["loss_distance"], search["confirm"], search["lost"]
+        )
+        morphology = foreground_morphology
+        if profiler is not None:
+            morphology = profiler.wrap(morphology, "morphology")
     k = 0
-    locations_list = []
     for i, frame in capture.frames():
-        bright = (np.sum(frame[:, :, 0]) / (capture.W() * capture.H())) > 30
+        if i < first_frame:
+            k += 1
+            continue
+        mask, bbox = frame[:, :, 0], None
+        if predictor is not None:
+            bbox = predictor.bbox(i, mask.shape[1], mask.shape[0])
+            if bbox is None:
+                morphology(mask)
+        bright = cv2.mean(mask)[0] > 30
         if not bright:
-            tmp_locations = tp.locate(
-                frame[:, :, 0], configuration["diameter"], **locate_options
-            )
+            if bbox is None:
+                tmp_locations = locate(mask, configuration["diameter"], **options)
+            else:
+                l, t, r, b = bbox
+                window = morphology(np.ascontiguousarray(mask[t:b, l:r]))
+                tmp_locations = locate(window, configuration["diameter"], **options)
+                tmp_locations["x"] += l
+                tmp_locations["y"] += t
+            if predictor is not None:
+                predictor.update(i, tmp_locations[["x", "y"]].to_numpy())
             if not tmp_locations.empty:
                 tmp_locations["frame"] = i
-                locations_list.append(tmp_locations)
+                yield tmp_locations
         if k % 100 == 0:
             print("    Located {}/{} frames".format(k, capture.length()))
         k += 1
     print("    Located {}/{} frames".format(k, capture.length()))
+    if predictor is not None:
+        print(
+            "    Searched {} whole frames and {} windows".format(
+                predictor.full_searches, predictor.window_searches
+            )
+        )
 
-    locations = pd.concat(locations_list)
+
+def trackpy_locate(capture, configuration, first_frame=0, profiler=None, search=None):
+    """Locate worm candidates in every frame whose index is at least 'first_frame'"""
+    locations_list = list(
+        trackpy_locate_iter(capture, configuration, first_frame, profiler, search)
+    )
+    locations = pd.concat(locations_list) if locations_list else pd.DataFrame()
+    return locations
+
+
+def split_capture(length, workers):
+    """Splits the range of frames into contiguous chunks, one per worker"""
+    bounds = np.linspace(0, length, workers + 1).astype(int)
+    return [
+        (start, stop) for start, stop in zip(bounds[:-1], bounds[1:]) if stop > start
+    ]
+
+
+def trackpy_locate_chunk(
+    path, start, stop, configuration, roi=None, profile=False, bad=None
+):
+    """Locate worm candidates in the frames ['start', 'stop') of the capture. The
+    preceding 'history' frames are also processed, so that the background model has
+    converged by the time it reaches 'start'. Returns the locations and the profiler"""
+    profiler = Profiler() if profile else None
+    warm_up = min(start, configuration["background_subtraction"]["history"])
+    capture = load_capture(path, configuration, start=start - warm_up, stop=stop)
+    if profiler is not None:
+        capture.profile(profiler)
+    if bad is not None:
+        capture = skip_bad_frames(capture, bad, start - warm_up)
+    search = predictive_search(configuration)
+    capture = preprocess_capture(capture, configuration["preprocessing"], roi)
+    capture = background_subtraction(
+        capture, configuration["background_subtraction"], morphology=search is None
+    )
+    locations = trackpy_locate(
+        capture,
+        configuration["trackpy"]["locate"],
+        first_frame=start,
+        profiler=profiler,
+        search=search,
+    )
+    return locations, profiler
+
+
+def parallel_trackpy_locate(
+    path, length, configuration, workers, roi=None, profiler=None, bad=None
+):
+    """Locate worm candidates in every frame, splitting the capture among 'workers'
+    processes. The frames flagged in 'bad' are skipped"""
+    chunks = split_capture(length, workers)
+    with multiprocessing.Pool(len(chunks)) as pool:
+        results = pool.starmap(
+            trackpy_locate_chunk,
+            [
+                (path, start, stop, configuration, roi, profiler is not None, bad)
+                for start, stop in chunks
+            ],
+        )
+    if profiler is not None:
+        for _, chunk_profiler in results:
+            profiler.merge(chunk_profiler)
+    locations_list = [l for l, _ in results if not l.empty]
+    locations = (
+        pd.concat(locations_list, ignore_index=True)
+        if locations_list
+        else pd.DataFrame()
+    )
     return locations
 
 
@@ -128,6 +413,64 @@ def trackpy_link(locations, configuration):
     return links
 
 
+def trackpy_link_iter(locations_iter, configuration):
+    """Link candidate locations into trajectories incrementally, frame by frame"""
+    tp.quiet()
+    return tp.link_df_iter(
+        locations_iter, configuration["search_range"], memory=configuration["memory"]
+    )
+
+
+def stream_worm(links_iter, configuration, memory, length, file, offset=(0, 0)):
+    """Determines the worm online, writing its labels as soon as they are decided"""
+    min_points = configuration["min_points"]
+    counts, last_seen = {}, {}
+    pending = deque()
+    state = {"next": 0, "label": (np.nan, np.nan)}
+
+    def _write(frame_no):
+        x, y = state["label"]
+        file.writelines(
+            [
+                "{};{:.2f};{:.2f}\n".format(f, x, y)
+                for f in range(state["next"], frame_no + 1)
+            ]
+        )
+        state["next"] = frame_no + 1
+
+    def _decide(frame_no, candidates):
+        best = 0
+        for particle, x, y in candidates:
+            if counts[particle] > max(min_points, best):
+                best = counts[particle]
+                label = (x + offset[0], y + offset[1])
+        _write(frame_no - 1)  # the frames without candidates keep the previous label
+        if best:
+            state["label"] = label
+        _write(frame_no)
+
+    for links in links_iter:
+        frame_no = int(links["frame"].iloc[0])
+        candidates = list(links[["particle", "x", "y"]].itertuples(index=False))
+        for particle, _, _ in candidates:
+            counts[particle] = counts.get(particle, 0) + 1
+            last_seen[particle] = frame_no
+        pending.append((frame_no, candidates))
+        while pending[0][0] <= frame_no - min_points:
+            _decide(*pending.popleft())
+        file.flush()
+
+        # trajectories that can't be linked anymore nor chosen for a pending frame
+        horizon = frame_no - max(memory, min_points) - 1
+        for particle in [p for p, seen in last_seen.items() if seen < horizon]:
+            del counts[particle], last_seen[particle]
+
+    while pending:
+        _decide(*pending.popleft())
+    if length > 0:
+        _write(length - 1)
+
+
 def find_worm(links, configuration):
     """Determine which trajectory corresponds to the worm"""
     particles = links["particle"].value_counts()
@@ -141,87 +484,206 @@ def find_worm(links, configuration):
     return worm
 
 
-def compute_labels(worm, capture):
-    """Computes the labels from the worm trajectory"""
-    worm = (
-        worm.set_index("frame")
-        .reindex(np.arange(capture.length()))
-        .reset_index()
-        .ffill()
-    )
-    labels = {
-        int(row["frame"]): np.array([row["x"], row["y"]]) for _, row in worm.iterrows()
-    }
-    return labels
-
-
-def main():
-    """Main function"""
-    arg_input, arg_configuration, arg_output, arg_annotation, arg_labels = parse_args(
-        sys.argv[1:]
+def compute_labels(worm, length, offset=(0, 0)):
+    """Computes the labels of the 'length' frames of the capture from the worm trajectory,
+    'offset' being the position of the processed frames within the original ones"""
+    return Trajectory.from_worm(worm, length, offset)
+
+
+def track(
+    path,
+    configuration,
+    output=None,
+    annotation_path=None,
+    labels_path=None,
+    workers=1,
+    profile=None,
+    stream=False,
+    use_cache=True,
+):
+    """Tracks the worm in the capture at 'path', writing the labels to 'output', the
+    annotated capture to 'annotation_path' and the profiling report to 'profile' if
+    given. Unless 'use_cache' is False or in 'stream' mode, the tracking starts from the
+    last stage whose output is in the stage cache. Returns the number of frames, the wall
+    time and, if the true labels are given, the evaluation"""
+    start_time = time.perf_counter()
+    profiler = Profiler() if profile is not None else None
+    capture = load_capture(path, configuration)
+    if profiler is not None:
+        capture.profile(profiler)
+    length = capture.length()
+    print("> Capture read: it has {} frames".format(length))
+    result = {"frames": length}
+
+    roi = petri_roi(capture, configuration["preprocessing"])
+    offset = roi_offset(capture, roi, configuration["preprocessing"])
+    if roi is not None:
+        print("> Petri dish: center {}, radius {}.".format(roi[0], roi[1]))
+
+    search = predictive_search(configuration)
+    cache = open_cache(configuration) if use_cache and not stream else StageCache()
+    cache_foreground = configuration.get("cache", {}).get("foreground", False)
+    keys = (
+        stage_keys(path, configuration, workers)
+        if cache.enabled()
+        else dict.fromkeys(["foreground", "locations", "links", "labels"])
     )
-    assert (
-        arg_output is not None or arg_annotation is not None or arg_labels is not None
+    cached_stages = [
+        ("labels", "trajectory"),
+        ("links", "dataframe"),
+        ("locations", "dataframe"),
+    ] + ([("foreground", "frames")] if cache_foreground else [])
+    # whether the tracking decodes the capture, i.e. a single worker and no cached stage
+    decode = workers == 1 and not any(
+        cache.contains(stage, keys[stage], kind) for stage, kind in cached_stages
     )
 
-    print("Worm tracker - Starting...")
-    configuration = None
-    if arg_configuration is None:
-        with open("default_configuration.yaml", "r") as file:
-            configuration = yaml.safe_load(file)
-        print("# Using default configuration")
-    else:
-        with open(arg_configuration, "r") as file:
-            configuration = yaml.safe_load(file)
-        print("# Using custom configuration")
-
-    print()
-
-    capture = LazyCapture.load(arg_input)
-    assert (
-        capture.W() == configuration["capture"]["width"]
-        and capture.H() == configuration["capture"]["height"]
-    )
-    print("> Capture read: it has {} frames".format(capture.length()))
-
-    capture = preprocess_capture(capture, configuration["preprocessing"])
-    print("> Capture preprocessed.")
-    capture = background_subtraction(capture, configuration["background_subtraction"])
-    print("> Capture background subtracted.")
-
-    print("> Starting trackpy location...")
-    locations = trackpy_locate(capture, configuration["trackpy"]["locate"])
-    print("> Trackpy location ended.")
-
-    print("> Starting trackpy linking...")
-    links = trackpy_link(locations, configuration["trackpy"]["link"])
-    print("> Trackpy linking ended.")
-
-    worm = find_worm(links, configuration["find_worm"])
-    print("> Worm found.")
-
-    labels = compute_labels(worm, capture)
-    print("> Labels computed.")
-
-    if arg_output is not None:
-        with open(arg_output, "w") as file:
+    annotation = capture.clone()  # the raw frames, decoded again
+    tee_size = configuration.get("capture", {}).get("tee_size", 0)
+    if annotation_path is not None and decode and tee_size > 0:
+        # the decoded frames feed both the tracking and the annotation, at most
+        # 'tee_size' MiB of them are kept for the latter, the rest is decoded again
+        capture, annotation = capture.tee(2, max_bytes=tee_size * 2**20)
+
+    with measure(profiler, "quality_index"):
+        bad = frame_quality(path, configuration)
+    if bad is not None:
+        print("> Quality index: {} frames skipped.".format(np.count_nonzero(bad)))
+        if decode:
+            capture = skip_bad_frames(capture, bad)
+
+    if stream:
+        capture = preprocess_capture(capture, configuration["preprocessing"], roi)
+        capture = background_subtraction(
+            capture, configuration["background_subtraction"], morphology=search is None
+        )
+        print("> Starting online tracking...")
+        locations_iter = trackpy_locate_iter(
+            capture,
+            configuration["trackpy"]["locate"],
+            profiler=profiler,
+            search=search,
+        )
+        links_iter = trackpy_link_iter(locations_iter, configuration["trackpy"]["link"])
+        with open(output, "w") as file:
             file.write("frame;x;y\n")
-            file.writelines(
-                ["{};{:.2f};{:.2f}\n".format(f, x, y) for f, (x, y) in labels.items()]
+            stream_worm(
+                links_iter,
+                configuration["find_worm"],
+                configuration["trackpy"]["link"]["memory"],
+                length,
+                file,
+                offset,
             )
+        print("> Online tracking ended.")
         print("+ Labels written.")
+        labels = None
+        if annotation_path is not None or labels_path is not None:
+            labels = load_output_labels(output)
+    else:
 
-    if arg_annotation is not None:
+        def _locations():
+            if workers > 1:
+                print(
+                    "> Starting parallel trackpy location ({} workers)...".format(
+                        workers
+                    )
+                )
+                locations = parallel_trackpy_locate(
+                    path,
+                    length,
+                    configuration,
+                    workers,
+                    roi,
+                    profiler,
+                    bad,
+                )
+                print("> Trackpy location ended.")
+                return locations
+
+            foreground, commit = None, None
+            if cache_foreground:
+                foreground = cache.load("foreground", keys["foreground"], "frames")
+            if foreground is None:
+                foreground = capture
+                if not decode:  # the cached stage was evicted meanwhile
+                    foreground = load_capture(path, configuration)
+                    if bad is not None:
+                        foreground = skip_bad_frames(foreground, bad)
+                foreground = preprocess_capture(
+                    foreground, configuration["preprocessing"], roi
+                )
+                print("> Capture preprocessed.")
+                foreground = background_subtraction(
+                    foreground,
+                    configuration["background_subtraction"],
+                    morphology=search is None,
+                )
+                print("> Capture background subtracted.")
+                if cache_foreground:
+                    foreground, commit = cache.tap_frames(
+                        "foreground", keys["foreground"], foreground
+                    )
+
+            print("> Starting trackpy location...")
+            locations = trackpy_locate(
+                foreground,
+                configuration["trackpy"]["locate"],
+                profiler=profiler,
+                search=search,
+            )
+            if commit is not None:
+                commit()
+            print("> Trackpy location ended.")
+            return locations
+
+        def _links():
+            locations = cache.get(
+                "locations", keys["locations"], "dataframe", _locations
+            )
+            print("> Starting trackpy linking...")
+            with measure(profiler, "link"):
+                links = trackpy_link(locations, configuration["trackpy"]["link"])
+            print("> Trackpy linking ended.")
+            return links
+
+        def _labels():
+            links = cache.get("links", keys["links"], "dataframe", _links)
+            with measure(profiler, "find_worm"):
+                worm = find_worm(links, configuration["find_worm"])
+            print("> Worm found.")
+
+            with measure(profiler, "compute_labels"):
+                labels = compute_labels(worm, length, offset)
+            print("> Labels computed.")
+            return labels
+
+        labels = cache.get("labels", keys["labels"], "trajectory", _labels)
+        cache.release()
+        if cache.hits:
+            print("> Loaded from the stage cache: {}.".format(", ".join(cache.hits)))
+
+        if output is not None:
+            if output.endswith(".trj"):
+                labels.save(output)
+            else:
+                labels.write_text(output)
+            print("+ Labels written.")
+
+    if annotation_path is not None:
         print("+ Starting annotation...")
-        annotation = LazyCapture.load(arg_input)
-        annotation.apply(
-            annotate(map_labels(labels, lambda l: larr2i(l)), color=[0, 255, 0])
+        annotation.apply(annotate(labels.astype(np.int32), color=[0, 255, 0]))
+        info = annotation.write(annotation_path)
+        if profiler is not None:
+            profiler.record("annotation_wait", info["wait_s"])
+        print(
+            "+ Annotation written ({:.2f} s waiting for the encoder).".format(
+                info["wait_s"]
+            )
         )
-        annotation.write(arg_annotation)
-        print("+ Annotation written.")
 
-    if arg_labels is not None:
-        true_labels = load_labels(arg_labels)
+    if labels_path is not None:
+        true_labels = load_true_labels(labels_path)
         eval_distance = evaluate(true_labels, labels, distance())
         eval_accuracy = evaluate(
             true_labels,
@@ -236,6 +698,62 @@ def main():
                 eval_distance[1], eval_accuracy[1]
             )
         )
+        result["count"] = eval_accuracy[0]
+        result["distance"] = eval_distance[1]
+        result["accuracy"] = eval_accuracy[1]
+
+    result["seconds"] = time.perf_counter() - start_time
+    if profiler is not None:
+        profiler.write(profile, length, result["seconds"])
+        print("+ Profiling report written.")
+    return result
+
+
+def main():
+    """Main function"""
+    (
+        arg_input,
+        arg_configuration,
+        arg_output,
+        arg_annotation,
+        arg_labels,
+        arg_workers,
+        arg_profile,
+        arg_stream,
+        arg_no_cache,
+    ) = parse_args(sys.argv[1:])
+    assert (
+        arg_output is not None or arg_annotation is not None or arg_labels is not None
+    )
+    assert arg_workers >= 1
+    assert not arg_stream or (
+        arg_output is not None and not arg_output.endswith(".trj") and arg_workers == 1
+    )
+
+    print("Worm tracker - Starting...")
+    configuration = None
+    if arg_configuration is None:
+        with open("default_configuration.yaml", "r") as file:
+            configuration = yaml.safe_load(file)
+        print("# Using default configuration")
+    else:
+        with open(arg_configuration, "r") as file:
+            configuration = yaml.safe_load(file)
+        print("# Using custom configuration")
+
+    print()
+
+    track(
+        arg_input,
+        configuration,
+        arg_output,
+        arg_annotation,
+        arg_labels,
+        arg_workers,
+        arg_profile,
+        arg_stream,
+        not arg_no_cache,
+    )
     print("Finished.")
 
 